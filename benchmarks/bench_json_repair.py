@@ -0,0 +1,81 @@
+"""
+Recovery rate and cost of `safe_json_loads` on malformed model output.
+
+Runs the corpus in benchmarks/data/malformed_outputs.json (fences, prose,
+trailing commas, truncation), then fuzzes valid outputs by truncating them
+at random points and wrapping them in fences and prose.
+
+    python benchmarks/bench_json_repair.py --fuzz 2000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench")   # server.py refuses to import without one
+
+from server import safe_json_loads  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "malformed_outputs.json")
+
+
+def recovered(raw: str) -> int:
+    try:
+        result = safe_json_loads(raw, "bench")
+    except ValueError:
+        return 0
+    return len(result)
+
+
+def time_call(raw: str, repeat: int = 2000) -> float:
+    started = time.perf_counter()
+    for _ in range(repeat):
+        try:
+            safe_json_loads(raw, "bench")
+        except ValueError:
+            pass
+    return (time.perf_counter() - started) / repeat * 1e6
+
+
+def fuzz_case(rng: random.Random, items: list) -> tuple[str, int]:
+    """A damaged rendering of `items` and how many objects are fully intact."""
+    parts = [json.dumps(item) for item in items]
+    text = "[" + ", ".join(parts) + (", " if rng.random() < 0.3 else "") + "]"
+    cut = rng.randint(len(text) // 2, len(text))
+    text = text[:cut]
+    intact = sum(1 for i in range(len(parts)) if len("[" + ", ".join(parts[:i + 1])) <= cut)
+    if rng.random() < 0.5:
+        text = "```json\n" + text + ("\n```" if cut == len(text) else "")
+    if rng.random() < 0.3:
+        text = "Sure! Here you go:\n" + text
+    return text, intact
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--fuzz", type=int, default=1000, help="number of fuzzed outputs")
+    args = parser.parse_args()
+
+    with open(CORPUS, encoding="utf-8") as fh:
+        corpus = json.load(fh)
+
+    print(f"{'case':<32} {'items':>5} {'expect':>6} {'µs/call':>8}")
+    ok = 0
+    for case in corpus:
+        got = recovered(case["raw"])
+        ok += got == case["expect_items"]
+        print(f"{case['name']:<32} {got:>5} {case['expect_items']:>6} {time_call(case['raw']):>8.1f}")
+    print(f"corpus: {ok}/{len(corpus)} cases recovered as expected")
+
+    rng = random.Random(0)
+    template = [{"question": f"Question {i}?", "options": ["A", "B", "C", "D"], "answer": "B"}
+                for i in range(5)]
+    expected = salvaged = 0
+    for _ in range(args.fuzz):
+        raw, intact = fuzz_case(rng, template)
+        expected += intact
+        salvaged += min(recovered(raw), intact)
+    print(f"fuzz: salvaged {salvaged}/{expected} intact objects from {args.fuzz} damaged outputs")
@@ -0,0 +1,73 @@
+"""
+Per-image OCR latency: one tesseract process per image vs a warm engine pool.
+
+Renders small synthetic "photo of notes" images (or uses the images in
+--images) and OCRs each of them with both engines.
+
+    python benchmarks/bench_ocr.py --count 20
+"""
+import argparse
+import glob
+import os
+import statistics
+import sys
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from workers import PytesseractEngine, TesserocrPool, tesserocr  # noqa: E402
+
+LINES = [
+    "Photosynthesis: 6CO2 + 6H2O -> C6H12O6 + 6O2",
+    "Light reactions happen in the thylakoid membrane.",
+    "The Calvin cycle fixes carbon in the stroma.",
+    "Rubisco is the most abundant enzyme on Earth.",
+]
+
+
+def synthetic_images(count: int) -> list[Image.Image]:
+    font = ImageFont.load_default(size=28)
+    images = []
+    for i in range(count):
+        image = Image.new("L", (900, 60 + 45 * len(LINES)), color=255)
+        draw = ImageDraw.Draw(image)
+        for row, line in enumerate(LINES):
+            draw.text((30, 30 + 45 * row), f"{i}. {line}", fill=0, font=font)
+        images.append(image)
+    return images
+
+
+def latencies(engine, images: list[Image.Image]) -> list[float]:
+    samples = []
+    for image in images:
+        started = time.perf_counter()
+        engine.image_to_string(image)
+        samples.append((time.perf_counter() - started) * 1000)
+    return samples
+
+
+def report(name: str, samples: list[float]) -> None:
+    samples = sorted(samples)
+    p95 = samples[int(0.95 * (len(samples) - 1))]
+    print(f"{name:<12} median {statistics.median(samples):8.1f} ms   p95 {p95:8.1f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=20, help="synthetic images to render")
+    parser.add_argument("--images", help="glob of real images to use instead")
+    args = parser.parse_args()
+
+    images = ([Image.open(p).convert("L") for p in sorted(glob.glob(args.images))]
+              if args.images else synthetic_images(args.count))
+    print(f"{len(images)} images")
+
+    report("pytesseract", latencies(PytesseractEngine(), images))
+    if tesserocr is None:
+        print("tesserocr    not installed (pip install tesserocr)")
+    else:
+        pool = TesserocrPool(1)
+        pool.image_to_string(images[0])             # warm-up, as a running server would be
+        report("tesserocr", latencies(pool, images))
@@ -0,0 +1,112 @@
+"""
+Throughput of the old (sync client) vs new (AsyncOpenAI) call path.
+
+Starts a local mock Chat Completions server that answers after a fixed delay,
+then drives `concurrency` coroutines against it for a few seconds each, the
+same way concurrent uploads drive `process()` inside one uvicorn worker.
+
+    python benchmarks/bench_openai.py --latency 0.5 --duration 5
+"""
+import argparse
+import asyncio
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from openai import AsyncOpenAI, OpenAI
+
+MOCK_PORT = 8765
+
+
+def mock_app(latency: float) -> FastAPI:
+    api = FastAPI()
+
+    @api.post("/v1/chat/completions")
+    async def completions(body: dict):
+        await asyncio.sleep(latency)
+        return {
+            "id": "chatcmpl-mock",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "finish_reason": "stop",
+                "message": {"role": "assistant", "content": "- point one\n- point two"},
+            }],
+            "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15},
+        }
+
+    return api
+
+
+def start_mock(latency: float) -> uvicorn.Server:
+    config = uvicorn.Config(mock_app(latency), port=MOCK_PORT, log_level="warning")
+    server = uvicorn.Server(config)
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+MESSAGES = [{"role": "user", "content": "Summarise these notes."}]
+
+
+async def run(call, concurrency: int, duration: float) -> float:
+    done = 0
+    stop_at = time.perf_counter() + duration
+
+    async def worker():
+        nonlocal done
+        while time.perf_counter() < stop_at:
+            await call()
+            done += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return done / (time.perf_counter() - started)
+
+
+async def main(args) -> None:
+    base_url = f"http://127.0.0.1:{MOCK_PORT}/v1"
+    sync_client = OpenAI(api_key="mock", base_url=base_url)
+    async_client = AsyncOpenAI(
+        api_key="mock",
+        base_url=base_url,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=100, max_keepalive_connections=100),
+        ),
+    )
+
+    async def before():
+        # What `process()` used to do: a blocking call inside a coroutine.
+        sync_client.chat.completions.create(model="mock", messages=MESSAGES)
+
+    async def after():
+        await async_client.chat.completions.create(model="mock", messages=MESSAGES)
+
+    print(f"mock latency {args.latency * 1000:.0f} ms, {args.duration:.0f} s per run")
+    print(f"{'clients':>8} {'before rps':>12} {'after rps':>12} {'speed-up':>10}")
+    for concurrency in args.concurrency:
+        rps_before = await run(before, concurrency, args.duration)
+        rps_after = await run(after, concurrency, args.duration)
+        print(f"{concurrency:>8} {rps_before:>12.1f} {rps_after:>12.1f} "
+              f"{rps_after / rps_before:>9.1f}x")
+
+    await async_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.5, help="mock completion delay (s)")
+    parser.add_argument("--duration", type=float, default=5.0, help="seconds per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 100])
+    args = parser.parse_args()
+
+    mock = start_mock(args.latency)
+    try:
+        asyncio.run(main(args))
+    finally:
+        mock.should_exit = True
@@ -0,0 +1,88 @@
+"""
+OCR time and character accuracy for each image preprocessing preset.
+
+By default renders a small set of synthetic phone photos of notes (large,
+slightly rotated, unevenly lit, noisy) with known text. Pass --images with a
+glob of real photos; each needs a sibling .txt file holding its transcript.
+
+    python benchmarks/bench_preprocess.py
+    python benchmarks/bench_preprocess.py --images 'samples/*.jpg'
+"""
+import argparse
+import difflib
+import glob
+import os
+import statistics
+import sys
+import time
+
+import numpy as np
+from PIL import Image, ImageDraw, ImageFont
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench")   # server.py refuses to import without one
+
+from server import OCR_PRESETS, get_ocr_engine, preprocess_image  # noqa: E402
+
+NOTES = [
+    "Newton's second law: F = m a",
+    "Momentum is conserved in closed systems.",
+    "Kinetic energy E = 1/2 m v^2",
+    "Work done equals force times displacement.",
+    "Power is the rate of doing work.",
+    "Impulse equals the change in momentum.",
+]
+
+
+def synthetic_samples() -> list[tuple[Image.Image, str]]:
+    rng = np.random.default_rng(0)
+    font = ImageFont.load_default(size=96)
+    samples = []
+    for angle in (0.0, 2.5, -4.0):
+        page = Image.new("L", (4000, 3000), color=235)
+        draw = ImageDraw.Draw(page)
+        for row, line in enumerate(NOTES):
+            draw.text((200, 250 + 400 * row), line, fill=40, font=font)
+        page = page.rotate(angle, fillcolor=235, resample=Image.Resampling.BICUBIC)
+        pixels = np.asarray(page, dtype=np.float32)
+        shadow = np.linspace(1.0, 0.6, pixels.shape[1], dtype=np.float32)[None, :]
+        pixels = pixels * shadow + rng.normal(0, 12, pixels.shape)
+        photo = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8)).convert("RGB")
+        samples.append((photo, "\n".join(NOTES)))
+    return samples
+
+
+def real_samples(pattern: str) -> list[tuple[Image.Image, str]]:
+    samples = []
+    for path in sorted(glob.glob(pattern)):
+        with open(os.path.splitext(path)[0] + ".txt", encoding="utf-8") as fh:
+            samples.append((Image.open(path), fh.read()))
+    return samples
+
+
+def accuracy(found: str, expected: str) -> float:
+    squash = lambda text: " ".join(text.split())   # noqa: E731
+    return difflib.SequenceMatcher(None, squash(found), squash(expected)).ratio()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", help="glob of real images with .txt transcripts")
+    args = parser.parse_args()
+
+    samples = real_samples(args.images) if args.images else synthetic_samples()
+    engine = get_ocr_engine()
+    print(f"{len(samples)} images, engine {engine.name}")
+    print(f"{'preset':<10} {'prep ms':>9} {'ocr ms':>9} {'accuracy':>9}")
+    for name, preset in OCR_PRESETS.items():
+        prep, ocr, acc = [], [], []
+        for image, expected in samples:
+            started = time.perf_counter()
+            ready = preprocess_image(image.copy(), preset)
+            prepared = time.perf_counter()
+            text = engine.image_to_string(ready)
+            prep.append((prepared - started) * 1000)
+            ocr.append((time.perf_counter() - prepared) * 1000)
+            acc.append(accuracy(text, expected))
+        print(f"{name:<10} {statistics.mean(prep):>9.0f} {statistics.mean(ocr):>9.0f} "
+              f"{statistics.mean(acc):>8.1%}")
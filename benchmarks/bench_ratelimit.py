@@ -0,0 +1,115 @@
+"""
+Burst behaviour against a provider that enforces RPM/TPM quotas.
+
+Starts a mock Chat Completions server with its own request and token
+buckets (429 once either is empty), fires a burst of concurrent requests
+and compares calling it directly with going through `RateLimiter`.
+
+    python benchmarks/bench_ratelimit.py --requests 150 --rpm 1200 --tpm 120000
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import threading
+import time
+
+import httpx
+import uvicorn
+from fastapi import FastAPI
+from fastapi.responses import JSONResponse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench")   # server.py refuses to import without one
+
+from server import RateLimiter, count_tokens  # noqa: E402
+
+MOCK_PORT = 8766
+OUTPUT_TOKENS = 200
+
+
+class Bucket:
+    def __init__(self, per_minute: int):
+        self.per_minute = per_minute
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.per_minute, self.level + (now - self.updated) * self.per_minute / 60)
+        self.updated = now
+
+
+def mock_app(rpm: int, tpm: int, latency: float) -> FastAPI:
+    requests, tokens = Bucket(rpm), Bucket(tpm)
+    api = FastAPI()
+
+    @api.post("/v1/chat/completions")
+    async def completions(body: dict):
+        cost = sum(count_tokens(m["content"]) for m in body["messages"]) + OUTPUT_TOKENS
+        requests.refill()
+        tokens.refill()
+        if requests.level < 1 or tokens.level < cost:
+            return JSONResponse({"error": {"message": "Rate limit reached"}}, status_code=429)
+        requests.level -= 1
+        tokens.level -= cost
+        await asyncio.sleep(latency)
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+    return api
+
+
+def start_mock(app: FastAPI) -> uvicorn.Server:
+    server = uvicorn.Server(uvicorn.Config(app, port=MOCK_PORT, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.05)
+    return server
+
+
+async def burst(n: int, prompt: str, limiter: RateLimiter | None) -> tuple[int, int, float]:
+    url = f"http://127.0.0.1:{MOCK_PORT}/v1/chat/completions"
+    body = {"model": "mock", "messages": [{"role": "user", "content": prompt}]}
+    estimate = count_tokens(prompt) + OUTPUT_TOKENS
+    ok = limited = 0
+
+    async def one(http: httpx.AsyncClient) -> None:
+        nonlocal ok, limited
+        if limiter is not None:
+            await limiter.acquire(estimate)
+        resp = await http.post(url, json=body)
+        if resp.status_code == 200:
+            ok += 1
+        elif resp.status_code == 429:
+            limited += 1
+
+    started = time.perf_counter()
+    async with httpx.AsyncClient(limits=httpx.Limits(max_connections=n), timeout=600) as http:
+        await asyncio.gather(*(one(http) for _ in range(n)))
+    return ok, limited, time.perf_counter() - started
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=150)
+    parser.add_argument("--rpm", type=int, default=1200)
+    parser.add_argument("--tpm", type=int, default=120000)
+    parser.add_argument("--prompt-tokens", type=int, default=800)
+    parser.add_argument("--latency", type=float, default=0.3)
+    args = parser.parse_args()
+
+    prompt = "notes " * args.prompt_tokens
+    print(f"{args.requests} requests of ~{count_tokens(prompt) + OUTPUT_TOKENS} tokens, "
+          f"quota {args.rpm} RPM / {args.tpm} TPM")
+    print(f"{'client':<10} {'ok':>5} {'429':>5} {'seconds':>8}")
+    for label, use_limiter in (("direct", False), ("limited", True)):
+        mock = start_mock(mock_app(args.rpm, args.tpm, args.latency))   # fresh quota per run
+        try:
+            with tempfile.TemporaryDirectory() as tmp:
+                limiter = RateLimiter(os.path.join(tmp, "rl.sqlite3"), args.rpm, args.tpm) if use_limiter else None
+                ok, limited, seconds = asyncio.run(burst(args.requests, prompt, limiter))
+        finally:
+            mock.should_exit = True
+            time.sleep(0.5)
+        print(f"{label:<10} {ok:>5} {limited:>5} {seconds:>8.1f}")
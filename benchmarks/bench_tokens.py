@@ -0,0 +1,42 @@
+"""
+Per-request cost of token budgeting on 100 KB of notes.
+
+    python benchmarks/bench_tokens.py
+"""
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "bench")   # server.py refuses to import without one
+
+from server import MODES, count_tokens, get_encoder, input_budget, truncate_to_tokens  # noqa: E402
+
+PARAGRAPH = (
+    "The Krebs cycle oxidises acetyl-CoA to CO2, producing NADH and FADH2 that feed "
+    "the electron transport chain. Each turn yields 3 NADH, 1 FADH2 and 1 GTP. "
+    "ΔG°' for the overall cycle is strongly negative, ≈ −40 kJ/mol.\n\n"
+)
+
+
+def timed(fn, repeat: int = 50) -> float:
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return statistics.median(samples)
+
+
+if __name__ == "__main__":
+    text = (PARAGRAPH * (100_000 // len(PARAGRAPH) + 1))[:100_000]
+
+    started = time.perf_counter()
+    get_encoder()
+    print(f"encoder load (once per process): {(time.perf_counter() - started) * 1000:8.2f} ms")
+
+    budget = input_budget(MODES["summary"])
+    print(f"100 KB, {count_tokens(text)} tokens, budget {budget} tokens")
+    print(f"count_tokens        median {timed(lambda: count_tokens(text)):8.2f} ms")
+    print(f"truncate_to_tokens  median {timed(lambda: truncate_to_tokens(text, budget)):8.2f} ms")
@@ -1,18 +1,53 @@
 # server.py
 import json
 import logging
+import asyncio
+import codecs
+import hashlib
+import hmac
+import io
+import math
+import multiprocessing
 import os
-import tempfile
-from typing import Dict, Any
+import random
+import re
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+import zlib
+from functools import lru_cache
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from multiprocessing import shared_memory
+from typing import Dict, Any, AsyncIterator, Awaitable, Callable, Iterator, NamedTuple, TypeVar
 
+import httpx
+import tiktoken
+import zstandard
 import fitz                    # PyMuPDF
-import pytesseract
-from PIL import Image
+import numpy as np
+import orjson
+from PIL import Image, ImageFilter, ImageOps
 from dotenv import load_dotenv
-from fastapi import FastAPI, UploadFile, Form
+from fastapi import FastAPI, UploadFile, Form, Header, Request
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from openai import OpenAI      # new SDK (≥ 1.0)
+from fastapi.responses import JSONResponse, StreamingResponse
+import openai
+from openai import AsyncOpenAI  # new SDK (≥ 1.0)
+from pydantic import BaseModel, ConfigDict, ValidationError
+
+import workers
+from workers import (
+    Piece, band_cuts, extract_page_range, get_ocr_engine, needs_ocr, ocr_band, ocr_pdf_pages,
+    page_info, render_page, stitch_bands,
+)
 
 # --------------------------------------------------------------------------- #
 #  Environment & Client setup
@@ -22,12 +57,160 @@ OPENAI_API_KEY: str | None = os.getenv("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
     raise RuntimeError("OPENAI_API_KEY is not set in the environment (.env)")
 
-client = OpenAI(api_key=OPENAI_API_KEY)
+# One pooled HTTP client per worker: keeps TLS connections to the API warm and
+# lets a single event loop hold many completions in flight at once.
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "100"))
+OPENAI_TIMEOUT_S = float(os.getenv("OPENAI_TIMEOUT_S", "60"))
+
+# Transient OpenAI failures (429, 5xx, connection errors) are retried up to
+# OPENAI_MAX_RETRIES times with full-jitter exponential backoff, honouring
+# Retry-After, but never past REQUEST_DEADLINE_S from the start of the request.
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+RETRY_BASE_S = float(os.getenv("RETRY_BASE_S", "0.5"))
+RETRY_MAX_S = float(os.getenv("RETRY_MAX_S", "8"))
+REQUEST_DEADLINE_S = float(os.getenv("REQUEST_DEADLINE_S", "55"))
+
+# Client-side token buckets matching the account's requests-per-minute and
+# tokens-per-minute quotas (0 disables one). Shared by all workers through a
+# SQLite file in CACHE_DIR.
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "200000"))
+
+http_client = httpx.AsyncClient(
+    limits=httpx.Limits(
+        max_connections=OPENAI_MAX_CONNECTIONS,
+        max_keepalive_connections=OPENAI_MAX_CONNECTIONS,
+        keepalive_expiry=30.0,
+    ),
+    timeout=httpx.Timeout(OPENAI_TIMEOUT_S, connect=5.0),
+)
+client = AsyncOpenAI(api_key=OPENAI_API_KEY, http_client=http_client, max_retries=0)
+
+# CPU-heavy extraction is spread across PROCESS_WORKERS processes
+# (PyMuPDF is not thread-safe). PDFs with at least PDF_PARALLEL_MIN_PAGES
+# pages are split into page ranges; images of at least OCR_TILE_MIN_PIXELS
+# are OCR'd as horizontal bands, cut between text lines within OCR_TILE_OVERLAP
+# pixels of an even split.
+PROCESS_WORKERS = int(os.getenv("PROCESS_WORKERS", os.getenv("PDF_WORKERS", str(os.cpu_count() or 1))))
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", "32"))
+PDF_PAGES_PER_TASK = int(os.getenv("PDF_PAGES_PER_TASK", "8"))
+OCR_TILE_MIN_PIXELS = int(os.getenv("OCR_TILE_MIN_PIXELS", "4000000"))
+OCR_TILE_OVERLAP = int(os.getenv("OCR_TILE_OVERLAP", "80"))
+# PDF_OCR_DPI and the OCR engine settings (OCR_ENGINE, OCR_LANG,
+# OCR_POOL_SIZE) are read in workers.py, which the pool workers import.
+
+# Default image preprocessing before OCR (see OCR_PRESETS); requests can pick
+# another with the `ocr_preset` form field.
+OCR_PRESET = os.getenv("OCR_PRESET", "balanced")
+
+# Extraction (PyMuPDF, Tesseract) runs on EXTRACTION_WORKERS threads with at
+# most EXTRACTION_QUEUE_SIZE jobs waiting; beyond that requests get a 503.
+EXTRACTION_WORKERS = int(os.getenv("EXTRACTION_WORKERS", str(os.cpu_count() or 1)))
+EXTRACTION_QUEUE_SIZE = int(os.getenv("EXTRACTION_QUEUE_SIZE", "32"))
+
+# Tokens of extracted text sent to the model per request (capped further by
+# the model's context window minus the output reserved for the mode). Enough
+# characters are extracted to fill it even for sparse text, then the text is
+# cut to the exact token budget on a paragraph or sentence boundary.
+INPUT_TOKEN_BUDGET = int(os.getenv("INPUT_TOKEN_BUDGET", "4000"))
+MAX_INPUT_CHARS = INPUT_TOKEN_BUDGET * 6
+MODEL_CONTEXT_TOKENS = {"gpt-4o-mini": 128_000, "gpt-4o": 128_000}
+
+# Extraction results are cached by content hash: a per-worker LRU in front of
+# a SQLite file shared by all workers. Bump EXTRACTOR_VERSION whenever
+# extraction output changes so stale entries are never served.
+EXTRACTOR_VERSION = "3"
+CACHE_DIR = os.getenv("CACHE_DIR", ".cache")
+EXTRACTION_CACHE_MEMORY_MB = int(os.getenv("EXTRACTION_CACHE_MEMORY_MB", "64"))
+EXTRACTION_CACHE_DISK_MB = int(os.getenv("EXTRACTION_CACHE_DISK_MB", "1024"))
+
+# LLM responses are cached by a hash of everything that shapes the completion.
+# LLM_CACHE_BACKEND is "memory" (per worker) or "sqlite" (shared by workers).
+OPENAI_MODEL = "gpt-4o-mini"           # change if you have a different entitlement
+OPENAI_TEMPERATURE = 0.5
+SYSTEM_PROMPT = "You are a helpful study assistant."
+PROMPT_VERSION = "2"                   # bump when any prompt template changes
+# Ask for flashcards/quiz through JSON-schema structured outputs instead of
+# parsing free-form JSON out of the completion text.
+STRUCTURED_OUTPUTS = os.getenv("STRUCTURED_OUTPUTS", "1") == "1"
+LLM_CACHE_BACKEND = os.getenv("LLM_CACHE_BACKEND", "sqlite")
+LLM_CACHE_TTL_S = float(os.getenv("LLM_CACHE_TTL_S", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_MB = int(os.getenv("LLM_CACHE_MEMORY_MB", "32"))
+LLM_CACHE_DISK_MB = int(os.getenv("LLM_CACHE_DISK_MB", "512"))
+
+# strategy=mapreduce summarises documents of up to MAPREDUCE_MAX_CHARS in
+# chunks of about MAPREDUCE_CHUNK_TOKENS, MAPREDUCE_CONCURRENCY at a time.
+MAPREDUCE_MAX_CHARS = int(os.getenv("MAPREDUCE_MAX_CHARS", "2000000"))
+MAPREDUCE_CHUNK_TOKENS = int(os.getenv("MAPREDUCE_CHUNK_TOKENS", "3000"))
+MAPREDUCE_CONCURRENCY = int(os.getenv("MAPREDUCE_CONCURRENCY", "8"))
+MAPREDUCE_MAX_DEPTH = 4                 # reduce rounds before merging whatever fits
+
+# How often a waiting request checks whether its client has gone away.
+DISCONNECT_POLL_S = float(os.getenv("DISCONNECT_POLL_S", "0.5"))
+
+# Background jobs: /api/jobs queues work in SQLite for worker processes.
+JOBS_DB = os.getenv("JOBS_DB", os.path.join("data", "jobs.sqlite3"))
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "0"))          # per web worker; 0 = only enqueue
+# Extraction threads, pool processes and Tesseract instances per job worker,
+# in place of EXTRACTION_WORKERS / PROCESS_WORKERS / OCR_POOL_SIZE.
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "1"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_LEASE_S = float(os.getenv("JOB_LEASE_S", "60"))       # silence after which a job is re-run
+JOB_DEADLINE_S = float(os.getenv("JOB_DEADLINE_S", "900"))
+JOB_RETENTION_S = float(os.getenv("JOB_RETENTION_S", str(7 * 24 * 3600)))
+
+# Speculative generation: after answering some modes, warm the response
+# cache with the others while the OpenAI quota has headroom.
+SPECULATIVE_GENERATION = os.getenv("SPECULATIVE_GENERATION", "0") == "1"
+SPECULATIVE_HEADROOM = float(os.getenv("SPECULATIVE_HEADROOM", "0.5"))
+SPECULATIVE_CONCURRENCY = int(os.getenv("SPECULATIVE_CONCURRENCY", "2"))
+
+# Document registry: extracted text kept for /api/documents/{id}/process.
+DOCUMENTS_DB = os.getenv("DOCUMENTS_DB", os.path.join("data", "documents.sqlite3"))
+DOCUMENTS_MEMORY_MB = int(os.getenv("DOCUMENTS_MEMORY_MB", "64"))
+DOCUMENTS_DISK_MB = int(os.getenv("DOCUMENTS_DISK_MB", "2048"))
+
+# /api/admin/* is disabled unless set, and then needs a matching X-Admin-Token header.
+ADMIN_TOKEN: str | None = os.getenv("ADMIN_TOKEN")
 
 # --------------------------------------------------------------------------- #
 #  FastAPI application & CORS
 # --------------------------------------------------------------------------- #
-app = FastAPI()
+async def startup() -> None:
+    await load_encoder()
+    if PROCESS_WORKERS > 1:
+        asyncio.get_running_loop().run_in_executor(None, warm_process_pool)
+    if JOB_WORKERS:
+        global _job_supervisor
+        _job_workers.extend(start_job_worker() for _ in range(JOB_WORKERS))
+        _job_supervisor = asyncio.create_task(supervise_job_workers())
+
+
+async def shutdown() -> None:
+    await client.close()
+    extraction_executor.shutdown()
+    if _process_pool is not None:
+        _process_pool.shutdown(cancel_futures=True)
+    if _job_supervisor is not None:
+        _job_supervisor.cancel()
+    for proc in _job_workers:
+        proc.terminate()                # the worker requeues its current job and exits
+    await asyncio.gather(*(run_in_threadpool(proc.join, 10) for proc in _job_workers))
+    for proc in _job_workers:
+        if proc.is_alive():
+            proc.kill()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI) -> AsyncIterator[None]:
+    await startup()
+    try:
+        yield
+    finally:
+        await shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -43,93 +226,2215 @@ app.add_middleware(
 logging.basicConfig(level=logging.INFO, format="%(levelname)s:%(name)s: %(message)s")
 logger = logging.getLogger("notegenie-backend")
 
+# --------------------------------------------------------------------------- #
+#  Metrics
+# --------------------------------------------------------------------------- #
+class Metrics:
+    """Per-worker counters and timing summaries, served by /api/admin/metrics."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counters: Dict[str, float] = {}
+        self.observations: Dict[str, Dict[str, float]] = {}
+
+    def incr(self, name: str, value: float = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.counters[name] = value
+
+    def observe(self, name: str, value: float) -> None:
+        with self._lock:
+            obs = self.observations.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+            obs["count"] += 1
+            obs["sum"] += value
+            obs["max"] = max(obs["max"], value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "pid": os.getpid(),
+                "counters": dict(self.counters),
+                "observations": {k: dict(v) for k, v in self.observations.items()},
+            }
+
+
+metrics = Metrics()
+
+T = TypeVar("T")
+
+
+class SingleFlight:
+    """Collapse concurrent calls with the same key onto one in-flight task.
+
+    Coalescing is per worker process; the caches cover repeats across workers.
+    The shared task is cancelled once every caller waiting on it is.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self._waiters: Dict[str, int] = {}
+
+    def _forget(self, key: str, task: asyncio.Future) -> None:
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+
+    def claim(self, key: str) -> asyncio.Future | None:
+        """Lead `key` from outside a task, e.g. while streaming the result.
+
+        Returns a future the caller must resolve once it has the result (or
+        fail); `do` calls for `key` wait on it meanwhile. None when `key` is
+        already in flight: join it with `do` instead.
+        """
+        if key in self._inflight:
+            return None
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        future.add_done_callback(lambda f: self._forget(key, f))
+        metrics.incr(f"singleflight.{self.name}.leaders")
+        return future
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        task = self._inflight.get(key)
+        if task is not None:
+            metrics.incr(f"singleflight.{self.name}.collapsed")
+        else:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._forget(key, t))
+            metrics.incr(f"singleflight.{self.name}.leaders")
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            # Shielded so one waiter going away doesn't cancel the others' result.
+            return await asyncio.shield(task)
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+                # The last waiter was cancelled; a claimed key runs on regardless.
+                if not task.done() and isinstance(task, asyncio.Task):
+                    self._forget(key, task)
+                    task.cancel()
+                    metrics.incr(f"singleflight.{self.name}.cancelled")
+
+
+extraction_flight = SingleFlight("extraction")
+generation_flight = SingleFlight("generation")
+
+
+class Unavailable(Exception):
+    """Temporary failure reported as 503/504 with a Retry-After header."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class Overloaded(Unavailable):
+    """A bounded queue is full; the client should retry after `retry_after` s."""
+
+    def __init__(self, what: str, retry_after: int):
+        super().__init__(f"The server is busy {what}, please retry shortly.", retry_after)
+
+
+class UpstreamUnavailable(Unavailable):
+    """OpenAI kept failing, or did not answer within the request deadline."""
+
+    def __init__(self, message: str, retry_after: int, timed_out: bool = False):
+        super().__init__(message, retry_after)
+        if timed_out:
+            self.status_code = 504
+
+
+class BoundedExecutor:
+    """Thread pool with a bounded backlog that rejects instead of queueing forever.
+
+    Records `<name>.queue_depth`, `<name>.in_flight`, `<name>.wait_ms`,
+    `<name>.run_ms` and `<name>.rejected` in `metrics`.
+    """
+
+    def __init__(self, name: str, workers: int, queue_size: int):
+        self.name = name
+        self.workers = workers
+        self.capacity = workers + queue_size
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self._in_flight = 0             # only touched on the event loop
+        self._avg_run_s = 1.0
+
+    def _record_depth(self) -> None:
+        metrics.gauge(f"{self.name}.in_flight", self._in_flight)
+        metrics.gauge(f"{self.name}.queue_depth", max(0, self._in_flight - self.workers))
+
+    def retry_after(self) -> int:
+        backlog = self._in_flight - self.workers + 1
+        return max(1, math.ceil(self._avg_run_s * backlog / self.workers))
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        if self._in_flight >= self.capacity:
+            metrics.incr(f"{self.name}.rejected")
+            raise Overloaded(self.name, self.retry_after())
+
+        submitted = time.perf_counter()
+
+        def job() -> T:
+            started = time.perf_counter()
+            metrics.observe(f"{self.name}.wait_ms", (started - submitted) * 1000)
+            try:
+                return fn(*args)
+            finally:
+                run_s = time.perf_counter() - started
+                metrics.observe(f"{self.name}.run_ms", run_s * 1000)
+                self._avg_run_s = 0.8 * self._avg_run_s + 0.2 * run_s
+
+        self._in_flight += 1
+        self._record_depth()
+        future = self._pool.submit(job)
+        # Counted until the job itself finishes: a cancelled caller leaves a
+        # running job behind, and it still occupies a thread.
+        loop = asyncio.get_running_loop()
+        future.add_done_callback(lambda _: loop.is_closed() or loop.call_soon_threadsafe(self._finished))
+        return await asyncio.wrap_future(future)
+
+    def _finished(self) -> None:
+        self._in_flight -= 1
+        self._record_depth()
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+extraction_executor = BoundedExecutor("extraction", EXTRACTION_WORKERS, EXTRACTION_QUEUE_SIZE)
+
+# --------------------------------------------------------------------------- #
+#  Caches
+# --------------------------------------------------------------------------- #
+class MemoryCache:
+    """Thread-safe in-process LRU bounded by the total size of its values.
+
+    Entries older than `ttl` seconds (if given) are treated as misses.
+    """
+
+    def __init__(self, max_bytes: int, ttl: float | None = None):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[bytes, float]] = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.evictions = 0
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[1] < time.time():
+                del self._data[key]
+                self._size -= len(entry[0])
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: str, blob: bytes) -> None:
+        if len(blob) > self.max_bytes:
+            return
+        expires = time.time() + self.ttl if self.ttl else float("inf")
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self._size -= len(old[0])
+            self._data[key] = (blob, expires)
+            self._size += len(blob)
+            while self._size > self.max_bytes:
+                _, (evicted, _) = self._data.popitem(last=False)
+                self._size -= len(evicted)
+                self.evictions += 1
+
+    def pop(self, key: str) -> bytes | None:
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return None
+            self._size -= len(entry[0])
+            return entry[0] if entry[1] >= time.time() else None
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._size = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self._data), "bytes": self._size, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        }
+
+
+class SQLiteCache:
+    """zstd-compressed key/value store in a SQLite file, LRU-evicted by size.
+
+    WAL mode lets every uvicorn worker read and write the same file. Entries
+    older than `ttl` seconds (if given) are treated as misses.
+    """
+
+    def __init__(self, path: str, max_bytes: int, ttl: float | None = None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._local = threading.local()
+        self.hits = self.misses = self.evictions = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                " key TEXT PRIMARY KEY, value BLOB NOT NULL,"
+                " size INTEGER NOT NULL, accessed REAL NOT NULL, expires REAL)"
+            )
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(entries)")}
+            if "expires" not in columns:    # files written before TTL support
+                conn.execute("ALTER TABLE entries ADD COLUMN expires REAL")
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str) -> bytes | None:
+        with self._conn() as conn:
+            now = time.time()
+            row = conn.execute(
+                "SELECT value FROM entries WHERE key = ? AND (expires IS NULL OR expires >= ?)",
+                (key, now),
+            ).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return zstandard.ZstdDecompressor().decompress(row[0])
+
+    def touch(self, key: str) -> None:
+        """Mark `key` as recently used without reading it."""
+        with self._conn() as conn:
+            conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (time.time(), key))
+
+    def set(self, key: str, blob: bytes) -> None:
+        packed = zstandard.ZstdCompressor(level=3).compress(blob)
+        now = time.time()
+        with self._conn() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, value, size, accessed, expires)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, packed, len(packed), now, now + self.ttl if self.ttl else None),
+            )
+            conn.execute("DELETE FROM entries WHERE expires < ?", (now,))
+            total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+            while total > self.max_bytes:
+                key_, size = conn.execute(
+                    "SELECT key, size FROM entries ORDER BY accessed LIMIT 1"
+                ).fetchone()
+                conn.execute("DELETE FROM entries WHERE key = ?", (key_,))
+                total -= size
+                self.evictions += 1
+
+    def clear(self) -> None:
+        with self._conn() as conn:
+            conn.execute("DELETE FROM entries")
+
+    def stats(self) -> Dict[str, Any]:
+        entries, size = self._conn().execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        return {
+            "entries": entries, "bytes": size, "max_bytes": self.max_bytes,
+            "hits": self.hits, "misses": self.misses, "evictions": self.evictions,
+        }
+
+
+class TieredCache:
+    """JSON values in a memory LRU, optionally backed by a shared on-disk tier.
+
+    Any object with the get/set/clear/stats interface of `SQLiteCache` can be
+    plugged in as the disk tier. With `touch_disk`, memory hits also refresh
+    the disk tier's LRU order, so entries that are hot in one worker aren't
+    evicted from the shared tier as if they were never read.
+    """
+
+    def __init__(self, memory: MemoryCache, disk: SQLiteCache | None = None, touch_disk: bool = False):
+        self.memory = memory
+        self.disk = disk
+        self.touch_disk = touch_disk
+
+    def get(self, key: str) -> Any | None:
+        blob = self.memory.get(key)
+        if blob is not None and self.touch_disk and self.disk is not None:
+            self.disk.touch(key)
+        if blob is None:
+            if self.disk is None:
+                return None
+            blob = self.disk.get(key)
+            if blob is None:
+                return None
+            self.memory.set(key, blob)
+        return json.loads(blob)
+
+    def set(self, key: str, value: Any) -> None:
+        blob = json.dumps(value).encode()
+        self.memory.set(key, blob)
+        if self.disk is not None:
+            self.disk.set(key, blob)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {"memory": self.memory.stats(), "disk": self.disk and self.disk.stats()}
+
+
+extraction_cache = TieredCache(
+    MemoryCache(EXTRACTION_CACHE_MEMORY_MB * 1024 * 1024),
+    SQLiteCache(os.path.join(CACHE_DIR, "extraction.sqlite3"), EXTRACTION_CACHE_DISK_MB * 1024 * 1024),
+)
+
+llm_cache = TieredCache(
+    MemoryCache(LLM_CACHE_MEMORY_MB * 1024 * 1024, ttl=LLM_CACHE_TTL_S),
+    SQLiteCache(os.path.join(CACHE_DIR, "llm.sqlite3"), LLM_CACHE_DISK_MB * 1024 * 1024, ttl=LLM_CACHE_TTL_S)
+    if LLM_CACHE_BACKEND == "sqlite" else None,
+)
+
+# Stored documents, keyed by the SHA-256 of the upload. The least recently
+# used ones are evicted once DOCUMENTS_DISK_MB is exceeded.
+documents = TieredCache(
+    MemoryCache(DOCUMENTS_MEMORY_MB * 1024 * 1024),
+    SQLiteCache(DOCUMENTS_DB, DOCUMENTS_DISK_MB * 1024 * 1024),
+    touch_disk=True,
+)
+
+CACHES: Dict[str, TieredCache] = {"extraction": extraction_cache, "llm": llm_cache, "documents": documents}
+
 # --------------------------------------------------------------------------- #
 #  Helpers
 # --------------------------------------------------------------------------- #
-def extract_text(upload: UploadFile) -> str:
-    """Extract text from PDF, image (OCR) or plain‑text file."""
-    suffix = upload.filename.rsplit(".", 1)[-1].lower()
-    with tempfile.NamedTemporaryFile(delete=False, suffix=f".{suffix}") as tmp:
-        tmp.write(upload.file.read())
-        path = tmp.name
+_process_pool: ProcessPoolExecutor | None = None
+_process_pool_lock = threading.Lock()     # extraction threads and the warm-up race to create it
+
 
+def get_process_pool() -> ProcessPoolExecutor:
+    """Lazily start the extraction process pool (spawned, so no fork-after-threads)."""
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(
+                max_workers=PROCESS_WORKERS, mp_context=multiprocessing.get_context("spawn")
+            )
+        return _process_pool
+
+
+def warm_process_pool() -> None:
+    """Start every pool worker now rather than on the first large PDF."""
+    pool = get_process_pool()
+    for future in [pool.submit(workers.ready) for _ in range(PROCESS_WORKERS)]:
+        future.result()
+
+
+@contextmanager
+def shared_copy(buffer: Any) -> Iterator[shared_memory.SharedMemory]:
+    """Copy a bytes-like `buffer` into a shared-memory segment for pool workers."""
+    view = memoryview(buffer).cast("B")
+    shm = shared_memory.SharedMemory(create=True, size=max(1, view.nbytes))
     try:
-        if suffix == "pdf":
-            doc = fitz.open(path)
-            text = "\n".join(page.get_text() for page in doc)
-        elif suffix in {"png", "jpg", "jpeg"}:
-            text = pytesseract.image_to_string(Image.open(path))
+        shm.buf[:view.nbytes] = view
+        yield shm
+    finally:
+        view.release()
+        shm.close()
+        shm.unlink()
+
+
+def iter_pdf_parallel(data: bytes, page_count: int) -> Iterator[Piece]:
+    """Yield pages in order, extracted in page ranges across the process pool.
+
+    Ranges are submitted a few at a time, so closing the generator early
+    leaves the rest of the document unextracted. The bytes are shared with
+    the workers, not pickled.
+    """
+    pending: deque = deque()
+    with shared_copy(data) as shm:
+        try:
+            pool = get_process_pool()
+            ranges = (
+                (start, min(start + PDF_PAGES_PER_TASK, page_count))
+                for start in range(0, page_count, PDF_PAGES_PER_TASK)
+            )
+            for start, stop in ranges:
+                pending.append(pool.submit(extract_page_range, shm.name, len(data), start, stop))
+                if len(pending) >= 2 * PROCESS_WORKERS:
+                    yield from pending.popleft().result()
+            while pending:
+                yield from pending.popleft().result()
+        finally:
+            for future in pending:
+                future.cancel()
+            for future in pending:      # running ones still hold the segment
+                if not future.cancelled():
+                    future.exception()
+
+
+# PyMuPDF is not thread-safe, even across documents, so extraction threads
+# take turns on it. Real parallelism comes from the process pool; OCR of a
+# page rendered here runs outside the lock.
+fitz_lock = threading.Lock()
+
+
+def iter_pdf_pages(doc: fitz.Document, data: bytes) -> Iterator[Piece]:
+    """Yield pages in order, reading text layers on this thread.
+
+    Scanned pages are rendered and OCR'd in parallel on the process pool a
+    batch at a time, so text-layer pages stay on the fast path. Each batch's
+    scans go out as one task per pool worker, as every task has to copy
+    and open the whole PDF.
+    """
+    batch_size = PDF_PAGES_PER_TASK * max(1, PROCESS_WORKERS)
+    with ExitStack() as stack:
+        shm = None
+        for start in range(0, doc.page_count, batch_size):
+            stop = min(start + batch_size, doc.page_count)
+            pieces: Dict[int, Piece] = {}
+            scans: list[int] = []
+            tasks: deque = deque()
+            try:
+                for index in range(start, stop):
+                    started = time.perf_counter()
+                    with fitz_lock:
+                        page = doc[index]
+                        text = page.get_text()
+                        scanned = needs_ocr(page, text)
+                        image = render_page(page) if scanned and PROCESS_WORKERS < 2 else None
+                    if not scanned:
+                        pieces[index] = Piece(text, page_info(index, "text", started))
+                    elif image is not None:
+                        text = get_ocr_engine().image_to_string(image)
+                        pieces[index] = Piece(text, page_info(index, "ocr", started))
+                    else:
+                        scans.append(index)
+                if scans:
+                    if shm is None:
+                        shm = stack.enter_context(shared_copy(data))
+                    per_task = math.ceil(len(scans) / PROCESS_WORKERS)
+                    for i in range(0, len(scans), per_task):
+                        tasks.append(
+                            get_process_pool().submit(ocr_pdf_pages, shm.name, len(data), scans[i:i + per_task])
+                        )
+                for index in range(start, stop):
+                    if index not in pieces:     # scans are grouped in page order
+                        pieces.update((piece.page["page"] - 1, piece) for piece in tasks.popleft().result())
+                    yield pieces[index]
+            finally:
+                for task in tasks:
+                    task.cancel()
+                for task in tasks:      # running ones still hold the segment
+                    if not task.cancelled():
+                        task.exception()
+
+
+def ocr_image(image: Image.Image) -> str:
+    """OCR an image; large ones as horizontal bands across the process pool."""
+    image = flatten_alpha(image)
+    if PROCESS_WORKERS < 2 or image.width * image.height < OCR_TILE_MIN_PIXELS:
+        return get_ocr_engine().image_to_string(image)
+
+    pixels = np.ascontiguousarray(np.asarray(image.convert("L")))
+    height, width = pixels.shape
+    bands = min(PROCESS_WORKERS, max(1, height // (4 * OCR_TILE_OVERLAP)))
+    cuts = band_cuts(pixels, bands, OCR_TILE_OVERLAP)
+    with shared_copy(pixels) as shm:
+        pool = get_process_pool()
+        futures = [pool.submit(ocr_band, shm.name, width, height, top, bottom) for top, bottom, _ in cuts]
+        metrics.incr("ocr.tiled_images")
+        return stitch_bands([f.result() for f in futures], [shared for *_, shared in cuts])
+
+
+class OCRPreset(NamedTuple):
+    dpi: int | None             # downscale to about this resolution (None: keep size)
+    binarize: bool              # adaptive (local mean) thresholding
+    deskew: bool                # straighten text lines tilted by up to ±5°
+
+
+OCR_PRESETS: Dict[str, OCRPreset | None] = {
+    "none": None,                               # image goes to Tesseract as uploaded
+    "fast": OCRPreset(200, binarize=False, deskew=False),
+    "balanced": OCRPreset(300, binarize=True, deskew=False),
+    "quality": OCRPreset(300, binarize=True, deskew=True),
+}
+
+# Photos carry no usable DPI, so assume the long edge spans a Letter/A4 page.
+ASSUMED_PAGE_INCHES = 11.0
+
+
+def adaptive_binarize(gray: Image.Image, radius: int = 15, k: float = 0.12) -> Image.Image:
+    """Black where a pixel is darker than its neighbourhood mean by more than k.
+
+    Copes with the uneven lighting of phone photos, where a global threshold
+    would black out shadows or wash out faint pencil.
+    """
+    local_mean = np.asarray(gray.filter(ImageFilter.BoxBlur(radius)), dtype=np.int16)
+    pixels = np.asarray(gray, dtype=np.int16)
+    ink = pixels * 100 < local_mean * int(100 - k * 100)
+    return Image.fromarray(np.where(ink, 0, 255).astype(np.uint8))
+
+
+def deskew(gray: Image.Image, max_angle: float = 5.0, step: float = 0.25) -> Image.Image:
+    """Rotate so text lines are horizontal, found by a projection-profile search.
+
+    Text rows give the sharpest row-to-row ink changes when level; the search
+    runs on a ~800 px thumbnail so it costs a few dozen small rotations.
+    """
+    scale = min(1.0, 800 / max(gray.size))
+    thumb = ImageOps.invert(gray.resize((max(1, int(gray.width * scale)), max(1, int(gray.height * scale)))))
+    best_angle, best_score = 0.0, -1.0
+    for angle in np.arange(-max_angle, max_angle + step, step):
+        rows = np.asarray(thumb.rotate(float(angle), fillcolor=0), dtype=np.float32).sum(axis=1)
+        score = float(np.square(np.diff(rows)).sum())
+        if score > best_score:
+            best_angle, best_score = float(angle), score
+    if abs(best_angle) < step:
+        return gray
+    return gray.rotate(best_angle, resample=Image.Resampling.BICUBIC, expand=True, fillcolor=255)
+
+
+def flatten_alpha(image: Image.Image) -> Image.Image:
+    """Composite a transparent image onto white.
+
+    Dropping the alpha channel instead would turn a transparent background
+    into whatever colour the hidden pixels have, usually black.
+    """
+    if image.mode in ("RGBA", "LA", "PA") or (image.mode == "P" and "transparency" in image.info):
+        rgba = image.convert("RGBA")
+        return Image.alpha_composite(Image.new("RGBA", rgba.size, "white"), rgba).convert("RGB")
+    return image
+
+
+def preprocess_image(image: Image.Image, preset: OCRPreset | None) -> Image.Image:
+    """EXIF rotation, downscale, grayscale, binarization and deskew per `preset`."""
+    if preset is None:
+        return image
+    target = preset.dpi * ASSUMED_PAGE_INCHES if preset.dpi else float("inf")
+    scale = target / max(image.size)
+    if scale < 1.0:                     # JPEG: let the decoder skip detail we'd discard
+        image.draft("L", (int(image.width * scale), int(image.height * scale)))
+    image = flatten_alpha(ImageOps.exif_transpose(image)).convert("L")
+    scale = target / max(image.size)
+    if scale < 1.0:
+        size = (int(image.width * scale), int(image.height * scale))
+        image = image.resize(size, Image.Resampling.LANCZOS)
+    if preset.binarize:
+        image = adaptive_binarize(image)
+    if preset.deskew:
+        image = deskew(image)
+    return image
+
+
+def iter_text(filename: str, data: bytes, ocr_preset: str = OCR_PRESET) -> Iterator[Piece]:
+    """Yield the text of a PDF, image (OCR) or plain‑text file piece by piece.
+
+    Pages for PDFs (scanned ones OCR'd), the OCR result for images and
+    decoded blocks for text files; pages and images carry timing info. Works
+    on the upload's bytes in memory; nothing is written to disk.
+    """
+    suffix = upload_suffix(filename)
+
+    if suffix == "pdf":
+        # PyMuPDF opens the bytes in place, no temp-file round-trip.
+        with fitz_lock:
+            doc = fitz.open(stream=data, filetype="pdf")
+            page_count = doc.page_count
+            if PROCESS_WORKERS > 1 and page_count >= PDF_PARALLEL_MIN_PAGES:
+                doc.close()
+                doc = None
+        if doc is None:
+            yield from iter_pdf_parallel(data, page_count)
         else:
-            with open(path, "r", encoding="utf‑8", errors="ignore") as fh:
-                text = fh.read()
+            try:
+                yield from iter_pdf_pages(doc, data)
+            finally:
+                with fitz_lock:
+                    doc.close()
+    elif suffix in {"png", "jpg", "jpeg"}:
+        started = time.perf_counter()
+        image = preprocess_image(Image.open(io.BytesIO(data)), OCR_PRESETS[ocr_preset])
+        yield Piece(ocr_image(image), page_info(0, "ocr", started))
+    else:
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        view = memoryview(data)
+        for offset in range(0, len(view), 64 * 1024):
+            yield Piece(decoder.decode(view[offset:offset + 64 * 1024]), None)
+        yield Piece(decoder.decode(b"", final=True), None)
+
+
+class Extracted(NamedTuple):
+    text: str
+    pages: list[Dict[str, Any]]         # per-page source and timing
+
+
+def extract_text(
+    filename: str,
+    data: bytes,
+    budget: int | None = MAX_INPUT_CHARS,
+    ocr_preset: str = OCR_PRESET,
+    cancelled: threading.Event | None = None,
+) -> Extracted:
+    """Extract up to `budget` characters (all of it for None), stopping early.
+
+    Once the budget is filled the remaining pages are never extracted, so a
+    1,000-page PDF costs the same as a 10-page one when only its head is used.
+    Setting `cancelled` stops it the same way after the current piece.
+    """
+    parts: list[str] = []
+    pages: list[Dict[str, Any]] = []
+    total = 0
+    pieces = iter_text(filename, data, ocr_preset)
+    try:
+        for piece in pieces:
+            if cancelled is not None and cancelled.is_set():
+                metrics.incr("extraction.cancelled")
+                break
+            if piece.page is not None:
+                pages.append(piece.page)
+            if not parts and not piece.text.strip():
+                continue                # leading blank pages don't count
+            parts.append(piece.text)
+            total += len(piece.text) + 1
+            if budget is not None and total >= budget:
+                break
     finally:
-        os.unlink(path)
+        pieces.close()
 
-    return text.strip()
+    text = "\n".join(parts).strip()
+    return Extracted(text if budget is None else text[:budget], pages)
 
 
-def call_openai(prompt: str, system: str = "You are a helpful study assistant.") -> str:
-    """Single call to OpenAI Chat Completion (new SDK syntax)."""
-    logger.info("Calling OpenAI | prompt length %d chars", len(prompt))
-    resp = client.chat.completions.create(
-        model="gpt-4o-mini",           # change if you have a different entitlement
-        messages=[
-            {"role": "system", "content": system},
-            {"role": "user", "content": prompt},
-        ],
-        temperature=0.5,
+def upload_digest(upload: UploadFile) -> str:
+    """SHA-256 of the upload contents, streamed from the spooled buffer."""
+    upload.file.seek(0)
+    digest = hashlib.sha256()
+    while block := upload.file.read(1024 * 1024):
+        digest.update(block)
+    upload.file.seek(0)
+    return digest.hexdigest()
+
+
+def upload_suffix(filename: str) -> str:
+    return filename.rsplit(".", 1)[-1].lower()
+
+
+def read_upload(upload: UploadFile) -> bytes:
+    upload.file.seek(0)
+    return upload.file.read()
+
+
+def extraction_key(filename: str, data: bytes, budget: int | None, ocr_preset: str) -> str:
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest}:{upload_suffix(filename)}:{budget}:{ocr_preset}:v{EXTRACTOR_VERSION}"
+
+
+def extract_and_store(
+    filename: str, data: bytes, budget: int | None, ocr_preset: str, key: str, cancelled: threading.Event
+) -> Extracted:
+    extracted = extract_text(filename, data, budget, ocr_preset, cancelled)
+    if not cancelled.is_set():          # a cancelled extraction is incomplete
+        extraction_cache.set(key, list(extracted))
+    return extracted
+
+
+async def _extract(filename: str, data: bytes, budget: int | None, ocr_preset: str, key: str) -> Extracted:
+    cancelled = threading.Event()
+    try:
+        return await extraction_executor.run(
+            extract_and_store, filename, data, budget, ocr_preset, key, cancelled
+        )
+    except asyncio.CancelledError:
+        cancelled.set()                 # the worker thread can't be interrupted, only told
+        raise
+
+
+async def load_text(
+    upload: UploadFile, budget: int | None = MAX_INPUT_CHARS, ocr_preset: str = OCR_PRESET
+) -> Extracted:
+    """Cached, coalesced extraction on the bounded extraction executor.
+
+    Identical uploads arriving together share the first one's extraction. The
+    upload is read into memory first: FastAPI closes its file when the request
+    that owns it goes away, and a coalesced extraction may outlive it.
+    Raises `Overloaded` when the extraction backlog is full.
+    """
+    filename, data = upload.filename or "", await run_in_threadpool(read_upload, upload)
+    key = await run_in_threadpool(extraction_key, filename, data, budget, ocr_preset)
+    cached = await run_in_threadpool(extraction_cache.get, key)
+    if cached is not None:
+        return Extracted(*cached)
+    return await extraction_flight.do(key, lambda: _extract(filename, data, budget, ocr_preset, key))
+
+
+# Absolute time.monotonic() by which the current request must be answered.
+request_deadline: ContextVar[float | None] = ContextVar("request_deadline", default=None)
+
+
+def start_deadline(seconds: float = REQUEST_DEADLINE_S) -> None:
+    request_deadline.set(time.monotonic() + seconds)
+
+
+def is_retryable(exc: Exception) -> bool:
+    if isinstance(exc, openai.APIConnectionError):      # includes timeouts
+        return True
+    return isinstance(exc, openai.APIStatusError) and (
+        exc.status_code in (408, 409, 429) or exc.status_code >= 500
     )
-    content = resp.choices[0].message.content.strip()
+
+
+def retry_after_s(exc: Exception) -> float | None:
+    """Server-requested wait from `retry-after-ms` / `Retry-After`, if any."""
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    if ms := response.headers.get("retry-after-ms"):
+        try:
+            return float(ms) / 1000
+        except ValueError:
+            pass
+    value = response.headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+async def with_retries(call: Callable[[], Awaitable[T]]) -> T:
+    """Run an OpenAI call, retrying transient failures within the deadline.
+
+    Backoff is full jitter, uniform(0, min(RETRY_MAX_S, base * 2**attempt)),
+    unless the server sent Retry-After. Records `openai.retries`,
+    `openai.give_ups`, `openai.deadline_exceeded` and `openai.retry_wait_ms`.
+    """
+    deadline = request_deadline.get()
+    attempt = 0
+    while True:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        try:
+            if remaining is not None and remaining <= 0:
+                raise asyncio.TimeoutError
+            return await asyncio.wait_for(call(), timeout=remaining)
+        except asyncio.TimeoutError:
+            metrics.incr("openai.deadline_exceeded")
+            raise UpstreamUnavailable("OpenAI did not answer in time.", 5, timed_out=True)
+        except Exception as exc:
+            if not is_retryable(exc):
+                raise
+            attempt += 1
+            delay = retry_after_s(exc)
+            if delay is None:
+                delay = random.uniform(0, min(RETRY_MAX_S, RETRY_BASE_S * 2 ** attempt))
+            out_of_time = deadline is not None and time.monotonic() + delay >= deadline
+            if attempt > OPENAI_MAX_RETRIES or out_of_time:
+                metrics.incr("openai.give_ups")
+                logger.error("Giving up on OpenAI after %d attempts: %s", attempt, exc)
+                raise UpstreamUnavailable(
+                    "OpenAI is temporarily unavailable, please retry shortly.",
+                    max(1, math.ceil(delay)),
+                ) from exc
+            logger.warning("OpenAI attempt %d failed (%s), retrying in %.2fs", attempt, exc, delay)
+            metrics.incr("openai.retries")
+            metrics.observe("openai.retry_wait_ms", delay * 1000)
+            await asyncio.sleep(delay)
+
+
+class RateLimiter:
+    """Token buckets for requests and tokens per minute, shared via SQLite.
+
+    Every worker refills and debits the same rows inside an IMMEDIATE
+    transaction, so together they stay under the quota. Within a worker,
+    callers queue on a FIFO lock and are served in arrival order instead
+    of racing for capacity.
+    """
+
+    def __init__(self, path: str, rpm: int, tpm: int):
+        self.path = path
+        self.limits = {"requests": rpm, "tokens": tpm}
+        self._local = threading.local()
+        self._queues: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()   # loop -> Lock
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets"
+                " (name TEXT PRIMARY KEY, level REAL NOT NULL, updated REAL NOT NULL)"
+            )
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def _take(self, cost: Dict[str, float]) -> float:
+        """Debit `cost` if every bucket covers it; else seconds until they would."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            levels, wait = {}, 0.0
+            for name, per_minute in self.limits.items():
+                if not per_minute:
+                    continue
+                row = conn.execute("SELECT level, updated FROM buckets WHERE name = ?", (name,)).fetchone()
+                level, updated = row if row else (per_minute, now)
+                level = min(per_minute, level + (now - updated) * per_minute / 60)
+                need = min(cost[name], per_minute)     # oversized requests wait for a full bucket
+                levels[name] = level - cost[name]
+                if level < need:
+                    wait = max(wait, (need - level) * 60 / per_minute)
+            if wait == 0:
+                for name, level in levels.items():
+                    conn.execute(
+                        "INSERT OR REPLACE INTO buckets (name, level, updated) VALUES (?, ?, ?)",
+                        (name, level, now),
+                    )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return wait
+
+    def credit(self, tokens: float) -> None:
+        """Return over-estimated tokens (or charge extra when negative)."""
+        if not self.limits["tokens"] or not tokens:
+            return
+        with self._conn() as conn:
+            conn.execute("UPDATE buckets SET level = level + ? WHERE name = 'tokens'", (tokens,))
+
+    def headroom(self) -> float:
+        """Fraction of the emptiest bucket available right now (1.0 when unlimited)."""
+        now = time.time()
+        fractions = [1.0]
+        for name, level, updated in self._conn().execute("SELECT name, level, updated FROM buckets"):
+            per_minute = self.limits.get(name)
+            if per_minute:
+                fractions.append(min(per_minute, level + (now - updated) * per_minute / 60) / per_minute)
+        return max(0.0, min(fractions))
+
+    def queued(self) -> bool:
+        """Whether callers in this worker are waiting for capacity."""
+        queue_lock = self._queues.get(asyncio.get_running_loop())
+        return queue_lock is not None and queue_lock.locked()
+
+    async def acquire(self, tokens: int) -> None:
+        """Wait in line until one request and `tokens` tokens are available.
+
+        Raises UpstreamUnavailable when the wait would overrun the deadline.
+        """
+        if not any(self.limits.values()):
+            return
+        loop = asyncio.get_running_loop()
+        queue_lock = self._queues.setdefault(loop, asyncio.Lock())
+        cost = {"requests": 1, "tokens": tokens}
+        started = time.monotonic()
+        async with queue_lock:
+            while wait := await run_in_threadpool(self._take, cost):
+                deadline = request_deadline.get()
+                if deadline is not None and time.monotonic() + wait > deadline:
+                    metrics.incr("ratelimit.rejected")
+                    raise UpstreamUnavailable(
+                        "OpenAI quota is exhausted for now, please retry shortly.",
+                        max(1, math.ceil(wait)),
+                    )
+                metrics.incr("ratelimit.throttled")
+                await asyncio.sleep(min(wait, 1.0))
+        metrics.observe("ratelimit.wait_ms", (time.monotonic() - started) * 1000)
+
+
+rate_limiter = RateLimiter(os.path.join(CACHE_DIR, "ratelimit.sqlite3"), OPENAI_RPM, OPENAI_TPM)
+
+
+async def create_completion(estimate: int, **kwargs: Any) -> Any:
+    """One rate-limited completion request charged `estimate` tokens up front.
+
+    A request that fails (429, 5xx, timeout) generated nothing, so the
+    estimate is handed back before the caller retries.
+    """
+    await rate_limiter.acquire(estimate)
+    try:
+        return await client.chat.completions.create(**kwargs)
+    except Exception:
+        await run_in_threadpool(rate_limiter.credit, estimate)
+        raise
+
+
+async def call_openai(
+    prompt: str,
+    system: str = SYSTEM_PROMPT,
+    response_format: Dict[str, Any] | None = None,
+    reserve_tokens: int = 1000,
+) -> str:
+    """Single call to OpenAI Chat Completion (async client, shared connection pool).
+
+    `reserve_tokens` is the output budget charged to the TPM bucket up front;
+    the estimate is corrected with the reported usage afterwards.
+    """
+    logger.info("Calling OpenAI | prompt length %d chars", len(prompt))
+    extra = {"response_format": response_format} if response_format else {}
+    estimate = count_tokens(system) + count_tokens(prompt) + reserve_tokens
+
+    def attempt():
+        return create_completion(
+            estimate,
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=OPENAI_TEMPERATURE,
+            **extra,
+        )
+
+    try:
+        resp = await with_retries(attempt)
+    except asyncio.CancelledError:
+        metrics.incr("openai.cancelled")
+        raise
+    if resp.usage is not None:
+        await run_in_threadpool(rate_limiter.credit, estimate - resp.usage.total_tokens)
+    message = resp.choices[0].message
+    if getattr(message, "refusal", None):
+        raise ValueError(f"OpenAI refused the request: {message.refusal}")
+    content = (message.content or "").strip()
     logger.info("OpenAI response length %d chars", len(content))
     return content
 
 
-def safe_json_loads(raw: str, kind: str) -> Dict[str, Any]:
-    """Parse JSON returned by the model, raising a clear 500 on failure."""
+async def stream_openai(
+    prompt: str,
+    system: str = SYSTEM_PROMPT,
+    response_format: Dict[str, Any] | None = None,
+    reserve_tokens: int = 1000,
+) -> AsyncIterator[str]:
+    """Streaming variant of `call_openai`: yields content deltas as they arrive.
+
+    Only opening the stream is retried; once tokens flow a failure is final.
+    The usage reported in the last chunk corrects the TPM estimate.
+    """
+    logger.info("Streaming OpenAI | prompt length %d chars", len(prompt))
+    extra = {"response_format": response_format} if response_format else {}
+    estimate = count_tokens(system) + count_tokens(prompt) + reserve_tokens
+
+    def attempt():
+        return create_completion(
+            estimate,
+            model=OPENAI_MODEL,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=OPENAI_TEMPERATURE,
+            stream=True,
+            stream_options={"include_usage": True},
+            **extra,
+        )
+
+    stream = await with_retries(attempt)
     try:
-        return json.loads(raw)
-    except json.JSONDecodeError as exc:
-        logger.error("JSON %s parsing failed: %s", kind, exc)
-        raise ValueError(f"Failed to parse {kind} JSON from OpenAI response.") from exc
+        async for chunk in stream:
+            if chunk.usage is not None:
+                await run_in_threadpool(rate_limiter.credit, estimate - chunk.usage.total_tokens)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        await stream.close()            # stop reading if our consumer went away
+
+
+_FENCE = re.compile(r"```[a-zA-Z]*\s*(.*?)\s*```", re.DOTALL)
+
+
+def strip_trailing_commas(text: str) -> str:
+    """Drop commas that directly precede `]` or `}`, leaving strings alone."""
+    out: list[str] = []
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch == ",":
+            rest = text[i + 1:i + 65].lstrip()
+            if rest[:1] in ("]", "}"):
+                continue
+        out.append(ch)
+    return "".join(out)
+
+
+def repair_json(raw: str) -> Any:
+    """Best-effort parse of a model's JSON answer.
+
+    Strips markdown fences, keeps the outermost array, drops trailing commas
+    and, if the array is still broken (e.g. truncated), salvages the objects
+    that did complete. Raises ValueError when nothing usable is left.
+    """
+    fenced = _FENCE.search(raw)
+    text = fenced.group(1) if fenced else raw
+    start, end = text.find("["), text.rfind("]")
+    if start != -1 and end > start:
+        text = text[start:end + 1]
+    try:
+        return orjson.loads(strip_trailing_commas(text))
+    except orjson.JSONDecodeError:
+        pass
+
+    items = JSONArrayStream().feed(raw)
+    if not items:
+        raise ValueError("no complete JSON objects in the response")
+    metrics.incr("llm.parse.salvaged")
+    return items
+
+
+def safe_json_loads(raw: str, kind: str) -> list[Any]:
+    """Parse the JSON list returned by the model, repairing common damage first.
+
+    A list wrapped in an object (`{"flashcards": [...]}`) is unwrapped.
+    Raises a clear 500-worthy ValueError only when nothing can be recovered.
+    """
+    try:
+        result = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        try:
+            result = repair_json(raw)
+        except ValueError as exc:
+            logger.error("JSON %s parsing failed: %s", kind, exc)
+            raise ValueError(f"Failed to parse {kind} JSON from OpenAI response.") from exc
+        metrics.incr("llm.parse.repaired")
+    if isinstance(result, dict):
+        lists = [value for value in result.values() if isinstance(value, list)]
+        if len(lists) == 1:
+            result = lists[0]
+    if not isinstance(result, list):
+        logger.error("JSON %s parsing failed: expected a list, got %s", kind, type(result).__name__)
+        raise ValueError(f"Failed to parse {kind} JSON from OpenAI response.")
+    return result
+
+
+@lru_cache(maxsize=None)
+def get_encoder(model: str = OPENAI_MODEL) -> tiktoken.Encoding:
+    """The model's tokenizer, loaded once per process."""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+
+
+async def load_encoder() -> None:
+    """Load the tokenizer off the event loop before any request needs it.
+
+    tiktoken downloads its BPE file on first use unless TIKTOKEN_CACHE_DIR
+    already holds it; without network access that has to be pre-seeded.
+    """
+    try:
+        await run_in_threadpool(get_encoder)
+    except Exception as exc:
+        raise RuntimeError(
+            f"Could not load the {OPENAI_MODEL} tokenizer ({exc}); "
+            "pre-populate TIKTOKEN_CACHE_DIR on hosts without internet access"
+        ) from exc
+
+
+def count_tokens(text: str) -> int:
+    return len(get_encoder().encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Cut `text` to at most `budget` tokens, ending on a natural boundary.
+
+    Backs off to the last paragraph, sentence or word break in the final
+    fifth of the allowed text, so nothing is cut mid-word or mid-formula.
+    """
+    encoder = get_encoder()
+    tokens = encoder.encode(text, disallowed_special=())
+    if len(tokens) <= budget:
+        return text
+
+    head = encoder.decode(tokens[:budget])
+    floor = len(head) * 4 // 5
+    for boundary in ("\n\n", ".\n", ". ", "? ", "! ", "\n", " "):
+        cut = head.rfind(boundary, floor)
+        if cut != -1:
+            return head[:cut + len(boundary)].rstrip()
+    return head
+
+
+class Flashcard(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    question: str
+    answer: str
+
+
+class QuizQuestion(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    question: str
+    options: list[str]
+    answer: str
+
+
+# Structured outputs need an object at the top level; the list inside is
+# what the API returns, under the same key as the response field.
+class FlashcardSet(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    flashcards: list[Flashcard]
+
+
+class QuizSet(BaseModel):
+    model_config = ConfigDict(extra="forbid")
+    questions: list[QuizQuestion]
+
+
+class Mode(NamedTuple):
+    response_key: str           # key of the result in the JSON response
+    instructions: str           # prepended to the extracted text
+    json_kind: str | None       # parse the completion as JSON when set
+    output_tokens: int          # context reserved for the answer
+    schema: type[BaseModel] | None = None   # structured-output model, if any
+    json_example: str | None = None         # shape of the JSON list asked for
+
+
+MODES: Dict[str, Mode] = {
+    "summary": Mode(
+        "summary",
+        "Summarise the following notes in concise bullet points:\n\n",
+        None,
+        800,
+    ),
+    "flashcards": Mode(
+        "flashcards",
+        "Generate exactly five Q‑and‑A flashcards from the notes below. ",
+        "flashcards",
+        1200,
+        FlashcardSet,
+        '[{"question":"...","answer":"..."}, …]',
+    ),
+    "quiz": Mode(
+        "questions",
+        "Create exactly five multiple‑choice questions (options A‑D) from these notes. ",
+        "quiz‑questions",
+        1600,
+        QuizSet,
+        '[{"question":"...","options":["A","B","C","D"],"answer":"B"}, …]',
+    ),
+}
+
+
+@lru_cache(maxsize=None)
+def schema_format(schema: type[BaseModel]) -> Dict[str, Any]:
+    return {
+        "type": "json_schema",
+        "json_schema": {"name": schema.__name__, "schema": schema.model_json_schema(), "strict": True},
+    }
+
+
+def response_format(spec: Mode) -> Dict[str, Any] | None:
+    if spec.schema is None or not STRUCTURED_OUTPUTS:
+        return None
+    return schema_format(spec.schema)
+
+
+def parse_completion(spec: Mode, raw: str) -> Any:
+    """Turn a completion into the mode's result, counting parse failures.
+
+    `llm.parse.structured.*` and `llm.parse.text.*` let the failure rate of
+    schema-validated output be compared with free-form JSON.
+    """
+    if spec.json_kind is None:
+        return raw
+    path = "structured" if response_format(spec) else "text"
+    try:
+        if path == "structured":
+            parsed = spec.schema.model_validate_json(raw)
+            result = [item.model_dump() for item in getattr(parsed, spec.response_key)]
+        else:
+            result = safe_json_loads(raw, spec.json_kind)
+    except ValidationError as exc:
+        metrics.incr(f"llm.parse.{path}.failed")
+        logger.error("JSON %s validation failed: %s", spec.json_kind, exc)
+        raise ValueError(f"Failed to parse {spec.json_kind} JSON from OpenAI response.") from exc
+    except ValueError:
+        metrics.incr(f"llm.parse.{path}.failed")
+        raise
+    metrics.incr(f"llm.parse.{path}.ok")
+    return result
+
+
+def instructions(spec: Mode) -> str:
+    """The mode's instructions, describing the JSON shape the API will enforce.
+
+    Structured outputs wrap the list in an object under the response key;
+    free-form JSON is asked for as the bare list.
+    """
+    if spec.json_example is None:
+        return spec.instructions
+    shape = spec.json_example
+    if response_format(spec):
+        shape = f'{{"{spec.response_key}": {shape}}}'
+    return f"{spec.instructions}Return *only* valid JSON in the form {shape}\n\n"
+
+
+def input_budget(spec: Mode) -> int:
+    """Tokens of notes that fit next to the prompt and the reserved output."""
+    context = MODEL_CONTEXT_TOKENS.get(OPENAI_MODEL, 16_000)
+    overhead = count_tokens(SYSTEM_PROMPT + instructions(spec)) + 16   # chat framing
+    return min(INPUT_TOKEN_BUDGET, context - spec.output_tokens - overhead)
+
+
+def build_prompt(spec: Mode, text: str) -> str:
+    return instructions(spec) + truncate_to_tokens(text, input_budget(spec))
+
+
+def llm_cache_key(prompt: str, system: str = SYSTEM_PROMPT) -> str:
+    material = [OPENAI_MODEL, system, PROMPT_VERSION, OPENAI_TEMPERATURE, prompt]
+    return hashlib.sha256(json.dumps(material).encode()).hexdigest()
+
+
+async def generate(mode: str, text: str) -> Any:
+    """Run `mode` over `text` through the LLM response cache.
+
+    JSON modes are cached already parsed, so hits skip `safe_json_loads`.
+    Identical requests in flight at the same time share one completion.
+    """
+    return await run_mode(MODES[mode], text)
+
+
+async def run_mode(spec: Mode, text: str) -> Any:
+    prompt = build_prompt(spec, text)
+    return await generate_coalesced(spec, prompt, llm_cache_key(prompt))
+
+
+async def generate_coalesced(spec: Mode, prompt: str, key: str) -> Any:
+    """`_generate` through `generation_flight`, also joining an identical stream."""
+    while True:
+        try:
+            return await generation_flight.do(key, lambda: _generate(spec, prompt, key))
+        except StreamAbandoned:
+            continue                    # the stream lost its client: generate (or join) anew
+
+
+async def _generate(spec: Mode, prompt: str, key: str) -> Any:
+    result = await run_in_threadpool(llm_cache.get, key)
+    if result is not None:
+        metrics.incr("llm_cache.hits")
+        count_speculative_hit(key)
+        return result
+    metrics.incr("llm_cache.misses")
+
+    raw = await call_openai(
+        prompt, response_format=response_format(spec), reserve_tokens=spec.output_tokens
+    )
+    result = parse_completion(spec, raw)
+    await run_in_threadpool(llm_cache.set, key, result)
+    if speculating.get():
+        speculative_marks.set(key, b"1")
+        metrics.incr("speculative.generated")
+    return result
+
+
+CHUNK_SUMMARY = Mode(
+    "summary",
+    "Summarise this section of a longer set of notes in concise bullet points. "
+    "Keep key terms, definitions and formulas:\n\n",
+    None,
+    800,
+)
+REDUCE_SUMMARY = Mode(
+    "summary",
+    "The following are bullet-point summaries of consecutive sections of one set of notes. "
+    "Merge them into a single set of concise bullet points without repetition:\n\n",
+    None,
+    800,
+)
+
+
+def chunk_text(text: str, max_tokens: int, content_defined: bool = True) -> list[str]:
+    """Split `text` on paragraph boundaries into chunks of at most `max_tokens`.
+
+    Besides the size limit, a chunk also ends after any paragraph whose hash
+    hits a fixed pattern (once the chunk is a quarter full). Those boundaries
+    depend only on content, so an edit early in a document shifts at most
+    a chunk or two and the rest keep their cached summaries. Without
+    `content_defined`, chunks are packed by size alone.
+    """
+    encoder = get_encoder()
+    paragraphs: list[tuple[str, int]] = []
+    for para in re.split(r"\n\s*\n", text):
+        tokens = encoder.encode(para.strip(), disallowed_special=())
+        for i in range(0, len(tokens), max_tokens):
+            piece = tokens[i:i + max_tokens]
+            paragraphs.append((encoder.decode(piece), len(piece)))
+
+    chunks: list[str] = []
+    current: list[str] = []
+    size = 0
+    for para, n_tokens in paragraphs:
+        if current and size + n_tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(para)
+        size += n_tokens + 1
+        if content_defined and size >= max_tokens // 4 and zlib.crc32(para.encode()) % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+
+async def summarise_mapreduce(text: str) -> str:
+    """Summarise chunks concurrently, then merge the partial summaries.
+
+    Each chunk summary goes through the response cache, so re-processing a
+    slightly edited document only pays for the chunks that changed. Partial
+    summaries that together exceed one chunk are merged hierarchically.
+    """
+    max_tokens = min(MAPREDUCE_CHUNK_TOKENS, input_budget(CHUNK_SUMMARY))
+    chunks = await run_in_threadpool(chunk_text, text, max_tokens)
+    if len(chunks) == 1:
+        return await generate("summary", chunks[0])
+
+    limit = asyncio.Semaphore(MAPREDUCE_CONCURRENCY)
+
+    async def summarise(spec: Mode, chunk: str) -> str:
+        async with limit:
+            return await run_mode(spec, chunk)
+
+    metrics.incr("mapreduce.chunks", len(chunks))
+    partials = await asyncio.gather(*(summarise(CHUNK_SUMMARY, c) for c in chunks))
+    for _ in range(MAPREDUCE_MAX_DEPTH):
+        merged = "\n\n".join(partials)
+        if count_tokens(merged) <= max_tokens:
+            return await run_mode(REDUCE_SUMMARY, merged)
+        groups = await run_in_threadpool(chunk_text, merged, max_tokens, False)
+        if len(groups) >= len(partials):
+            break                       # summaries aren't shrinking
+        metrics.incr("mapreduce.reduce_groups", len(groups))
+        partials = await asyncio.gather(*(summarise(REDUCE_SUMMARY, g) for g in groups))
+
+    # Not converging: merge the head of the partial summaries in one call.
+    metrics.incr("mapreduce.reduce_truncated")
+    return await run_mode(REDUCE_SUMMARY, "\n\n".join(partials))
+
+
+# --------------------------------------------------------------------------- #
+#  Speculative generation
+# --------------------------------------------------------------------------- #
+# Keys of cache entries written by speculation, kept until their first hit so
+# speculative.hits / speculative.generated is the hit rate. Per worker, one
+# byte per key: it holds the last 4096 speculative results and is empty (and
+# never consulted) unless this worker speculates.
+speculative_marks = MemoryCache(4096, ttl=LLM_CACHE_TTL_S)
+
+# Set inside speculative tasks, so `_generate` only marks completions that
+# speculation itself asked OpenAI for (not ones it joined or found cached).
+speculating: ContextVar[bool] = ContextVar("speculating", default=False)
+
+_speculative_slots = asyncio.Semaphore(SPECULATIVE_CONCURRENCY)
+_speculative_tasks: set = set()
+
+
+def schedule_speculation(served: list[str], text: str) -> None:
+    """Generate the modes not asked for in the background to warm the cache."""
+    for mode in MODES:
+        if mode not in served:
+            task = asyncio.create_task(_speculate(MODES[mode], text))
+            _speculative_tasks.add(task)        # keep a reference until it finishes
+            task.add_done_callback(_speculative_tasks.discard)
+            metrics.incr("speculative.scheduled")
+
+
+async def _speculate(spec: Mode, text: str) -> None:
+    key = llm_cache_key(build_prompt(spec, text))
+    async with _speculative_slots:
+        if await run_in_threadpool(llm_cache.get, key) is not None:
+            metrics.incr("speculative.already_cached")
+            return
+        # Only spend quota nobody in the foreground is waiting for.
+        if rate_limiter.queued() or await run_in_threadpool(rate_limiter.headroom) < SPECULATIVE_HEADROOM:
+            metrics.incr("speculative.skipped")
+            return
+        start_deadline()
+        speculating.set(True)
+        try:
+            await run_mode(spec, text)
+        except Exception as exc:
+            metrics.incr("speculative.failed")
+            logger.info("speculative %s failed: %s", spec.response_key, exc)
+
+
+def count_speculative_hit(key: str) -> None:
+    """Count the first foreground hit on a speculatively generated entry."""
+    if speculative_marks and not speculating.get() and speculative_marks.pop(key) is not None:
+        metrics.incr("speculative.hits")
 
 
 # --------------------------------------------------------------------------- #
 #  Main endpoint
 # --------------------------------------------------------------------------- #
-@app.post("/api/process")
-async def process(file: UploadFile, mode: str = Form(...)):
+def unavailable_response(exc: Unavailable) -> JSONResponse:
+    return JSONResponse(
+        {"error": str(exc)},
+        status_code=exc.status_code,
+        headers={"Retry-After": str(exc.retry_after)},
+    )
+
+
+class ClientDisconnected(Exception):
+    """The client went away before its answer was ready."""
+
+
+def disconnected_response() -> JSONResponse:
+    # nginx's "client closed request"; nobody is left to read it.
+    return JSONResponse({"error": "Client closed request."}, status_code=499)
+
+
+async def unless_disconnected(request: Request, work: Awaitable[T]) -> T:
+    """Await `work`, cancelling it if the client disconnects first.
+
+    Cancellation reaches shared extractions and completions through
+    SingleFlight, which stops them once nobody else is waiting.
+    """
+    task = asyncio.ensure_future(work)
     try:
-        text = extract_text(file)[:15_000]  # length guard for tokens
-        if not text:
-            return JSONResponse({"error": "No readable text found in the file."}, status_code=400)
-
-        if mode == "summary":
-            prompt = f"Summarise the following notes in concise bullet points:\n\n{text}"
-            summary = call_openai(prompt)
-            return {"summary": summary}
-
-        if mode == "flashcards":
-            prompt = (
-                "Generate exactly five Q‑and‑A flashcards from the notes below. "
-                'Return *only* valid JSON in the form '
-                '[{"question":"...","answer":"..."}, …]\n\n' + text
-            )
-            flashcards = safe_json_loads(call_openai(prompt), "flashcards")
-            return {"flashcards": flashcards}
-
-        if mode == "quiz":
-            prompt = (
-                "Create exactly five multiple‑choice questions (options A‑D) from these notes. "
-                'Return *only* valid JSON in the form '
-                '[{"question":"...","options":["A","B","C","D"],"answer":"B"}, …]\n\n' + text
-            )
-            questions = safe_json_loads(call_openai(prompt), "quiz‑questions")
-            return {"questions": questions}
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_S)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.incr("requests.cancelled")
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
 
+async def until_disconnected(request: Request, frames: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Pass `frames` through, closing them (and the upstream stream) on disconnect."""
+    checked = time.monotonic()
+    try:
+        async for item in frames:
+            if time.monotonic() - checked >= DISCONNECT_POLL_S:
+                checked = time.monotonic()
+                if await request.is_disconnected():
+                    metrics.incr("requests.cancelled")
+                    return
+            yield item
+    finally:
+        await frames.aclose()
+
+
+def parse_modes(mode: str) -> list[str] | None:
+    """`summary`, `summary,quiz` or `all` -> mode names; None if any is unknown."""
+    if mode == "all":
+        return list(MODES)
+    modes = list(dict.fromkeys(part.strip() for part in mode.split(",")))
+    if not all(m in MODES for m in modes):
+        return None
+    return modes
+
+
+def invalid_request(modes: list[str] | None, strategy: str, ocr_preset: str) -> JSONResponse | None:
+    if not modes:
         return JSONResponse({"error": "Invalid mode selected."}, status_code=400)
+    if ocr_preset not in OCR_PRESETS:
+        return JSONResponse({"error": "Invalid OCR preset selected."}, status_code=400)
+    if strategy not in {"truncate", "mapreduce"}:
+        return JSONResponse({"error": "Invalid strategy selected."}, status_code=400)
+    if strategy == "mapreduce" and "summary" not in modes:
+        return JSONResponse({"error": "Map-reduce is only available for summaries."}, status_code=400)
+    return None
+
+
+async def generate_modes(modes: list[str], text: str, strategy: str) -> Dict[str, Any]:
+    """Run several modes over one text concurrently and merge their answers.
+
+    Modes that fail are reported under "errors"; if all of them fail the
+    first error is raised instead.
+    """
+    async def one(mode: str) -> Any:
+        if strategy == "mapreduce" and mode == "summary":
+            return await summarise_mapreduce(text)
+        # Only the summary reads a map-reduce text in full; the rest are cut
+        # to the input budget, and tokenising 2M characters for that would
+        # stall the event loop.
+        return await generate(mode, text[:MAX_INPUT_CHARS])
+
+    if len(modes) == 1:
+        return {MODES[modes[0]].response_key: await one(modes[0])}
+
+    results = await asyncio.gather(*(one(m) for m in modes), return_exceptions=True)
+    body: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for mode, result in zip(modes, results):
+        if not isinstance(result, BaseException):
+            body[MODES[mode].response_key] = result
+        elif isinstance(result, Exception):
+            if not isinstance(result, (Unavailable, ValueError)):
+                logger.error("%s generation failed", mode, exc_info=result)
+            errors[mode] = str(result)
+        else:
+            raise result                    # cancelled
+    if not body:
+        raise next(r for r in results if isinstance(r, Exception))
+    if errors:
+        body["errors"] = errors
+    return body
+
+
+async def run_pipeline(
+    source: UploadFile | Extracted,
+    modes: list[str],
+    strategy: str,
+    ocr_preset: str = OCR_PRESET,
+    speculative: bool = False,
+) -> tuple[Dict[str, Any], int]:
+    """Extract once and generate every mode; returns the body and its status code.
 
+    `source` is an upload, or the text of a stored document. With
+    `speculative`, the remaining modes are then generated in the background.
+    Raises `Unavailable` so callers can decide between a 503 and a retry.
+    """
+    try:
+        if isinstance(source, Extracted):
+            # Same length guard as uploads, so build_prompt never tokenises
+            # a whole stored document on the event loop.
+            text, pages = source
+            text = text[:MAPREDUCE_MAX_CHARS if strategy == "mapreduce" else MAX_INPUT_CHARS]
+        elif strategy == "mapreduce":
+            text, pages = await load_text(source, MAPREDUCE_MAX_CHARS, ocr_preset)
+        else:
+            text, pages = await load_text(source, MAX_INPUT_CHARS, ocr_preset)  # length guard for tokens
+        if not text:
+            return {"error": "No readable text found in the file."}, 400
+
+        body = await generate_modes(modes, text, strategy)
+        if speculative:         # speculated modes never map-reduce
+            schedule_speculation(modes, text[:MAX_INPUT_CHARS])
+        if pages:
+            body["meta"] = {"pages": pages}
+        return body, 200
+
+    except Unavailable:              # extraction backlog full, OpenAI down or too slow
+        raise
     except ValueError as ve:         # JSON parsing or other validation
-        return JSONResponse({"error": str(ve)}, status_code=500)
+        return {"error": str(ve)}, 500
     except Exception as exc:         # catch‑all
+        logger.exception("Unexpected error")
+        return {"error": str(exc)}, 500
+
+
+@app.post("/api/process")
+async def process(
+    request: Request,
+    file: UploadFile,
+    mode: str = Form(...),
+    strategy: str = Form("truncate"),
+    ocr_preset: str = Form(OCR_PRESET),
+    speculate: bool = Form(SPECULATIVE_GENERATION),
+):
+    modes = parse_modes(mode)
+    if invalid := invalid_request(modes, strategy, ocr_preset):
+        return invalid
+
+    start_deadline()
+    try:
+        body, status = await unless_disconnected(
+            request, run_pipeline(file, modes, strategy, ocr_preset, speculate)
+        )
+    except Unavailable as exc:
+        return unavailable_response(exc)
+    except ClientDisconnected:
+        return disconnected_response()
+    return body if status == 200 else JSONResponse(body, status_code=status)
+
+
+def sse(event: str, data: Any) -> str:
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def ndjson(event: str, data: Any) -> str:
+    """One newline-delimited JSON frame."""
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+class JSONArrayStream:
+    """Pull complete objects out of a JSON array as its text streams in.
+
+    Everything before the first `[` (prose, code fences) is skipped, and each
+    top-level `{...}` element is returned by `feed` as soon as it closes.
+    """
+
+    def __init__(self):
+        self._state = "before"          # before | array | after
+        self._buf: list[str] = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    def feed(self, chunk: str) -> list[Any]:
+        items: list[Any] = []
+        for ch in chunk:
+            if self._state != "array":
+                if self._state == "before" and ch == "[":
+                    self._state = "array"
+                continue
+            if self._depth == 0:
+                if ch == "{":
+                    self._depth = 1
+                    self._buf = [ch]
+                elif ch == "]":
+                    self._state = "after"
+                continue
+
+            self._buf.append(ch)
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+            elif ch == '"':
+                self._in_string = True
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._depth == 0:
+                    raw = "".join(self._buf)
+                    try:
+                        items.append(orjson.loads(raw))
+                    except orjson.JSONDecodeError:
+                        try:
+                            items.append(orjson.loads(strip_trailing_commas(raw)))
+                        except orjson.JSONDecodeError:
+                            logger.warning("Skipping malformed streamed item")
+        return items
+
+
+class StreamAbandoned(Exception):
+    """The stream generating a coalesced completion lost its client."""
+
+
+async def stream_generation(
+    mode: str, prompt: str, key: str, frame: Callable[[str, Any], str]
+) -> AsyncIterator[str]:
+    """Frames for a fresh completion, then `done` with the usual JSON payload.
+
+    Summaries stream as `delta` events; flashcards and quiz questions stream
+    as one `item` event per object, emitted the moment it closes. Identical
+    requests arriving meanwhile (streamed or not) join it through
+    `generation_flight` and get the finished result.
+    """
+    published = generation_flight.claim(key)
+    if published is None:
+        async for joined in joined_generation(mode, prompt, key, frame):
+            yield joined
+        return
+
+    spec = MODES[mode]
+    parser = JSONArrayStream() if spec.json_kind else None
+    parts: list[str] = []
+    stream = stream_openai(
+        prompt, response_format=response_format(spec), reserve_tokens=spec.output_tokens
+    )
+    try:
+        async for delta in stream:
+            parts.append(delta)
+            if parser is None:
+                yield frame("delta", {"text": delta})
+            else:
+                for item in parser.feed(delta):
+                    yield frame("item", item)
+        raw = "".join(parts).strip()
+        result = parse_completion(spec, raw)
+    except (asyncio.CancelledError, GeneratorExit):
+        metrics.incr("stream.cancelled")
+        publish_failure(published, StreamAbandoned())
+        raise
+    except Exception as exc:
+        logger.exception("Streaming failed")
+        publish_failure(published, exc)
+        yield frame("error", {"error": str(exc)})
+        return
+    finally:
+        await stream.aclose()
+
+    await run_in_threadpool(llm_cache.set, key, result)
+    if not published.done():            # all joined callers may have gone
+        published.set_result(result)
+    yield frame("done", {spec.response_key: result})
+
+
+def publish_failure(published: asyncio.Future, exc: Exception) -> None:
+    if not published.done():
+        published.set_exception(exc)
+        published.exception()           # joined callers see it; don't log it as unretrieved
+
+
+async def joined_generation(
+    mode: str, prompt: str, key: str, frame: Callable[[str, Any], str]
+) -> AsyncIterator[str]:
+    """Frames for a completion another request is already generating."""
+    try:
+        result = await generate_coalesced(MODES[mode], prompt, key)
+    except Exception as exc:
+        yield frame("error", {"error": str(exc)})
+        return
+    for replayed in replay_frames(mode, result, frame):
+        yield replayed
+
+
+def replay_frames(mode: str, result: Any, frame: Callable[[str, Any], str]) -> list[str]:
+    """The frames `stream_generation` would have sent for a cached result."""
+    spec = MODES[mode]
+    if spec.json_kind is None:
+        head = [frame("delta", {"text": result})]
+    else:
+        head = [frame("item", item) for item in result]
+    return head + [frame("done", {spec.response_key: result})]
+
+
+@app.post("/api/process/stream")
+async def process_stream(
+    request: Request,
+    file: UploadFile,
+    mode: str = Form(...),
+    ocr_preset: str = Form(OCR_PRESET),
+    accept: str | None = Header(None),
+):
+    """Like /api/process, but streams the answer as it is generated.
+
+    Server-Sent Events by default, NDJSON for `Accept: application/x-ndjson`.
+    """
+    if mode not in MODES:
+        return JSONResponse({"error": "Invalid mode selected."}, status_code=400)
+    if ocr_preset not in OCR_PRESETS:
+        return JSONResponse({"error": "Invalid OCR preset selected."}, status_code=400)
+
+    start_deadline()
+    try:
+        text, _ = await unless_disconnected(request, load_text(file, MAX_INPUT_CHARS, ocr_preset))
+    except Unavailable as exc:
+        return unavailable_response(exc)
+    except ClientDisconnected:
+        return disconnected_response()
+    except Exception as exc:
         logger.exception("Unexpected error")
         return JSONResponse({"error": str(exc)}, status_code=500)
+    if not text:
+        return JSONResponse({"error": "No readable text found in the file."}, status_code=400)
+
+    if accept and "application/x-ndjson" in accept:
+        frame, media_type = ndjson, "application/x-ndjson"
+    else:
+        frame, media_type = sse, "text/event-stream"
+
+    prompt = build_prompt(MODES[mode], text)
+    key = llm_cache_key(prompt)
+    cached = await run_in_threadpool(llm_cache.get, key)
+    if cached is not None:
+        count_speculative_hit(key)
+        frames = iter(replay_frames(mode, cached, frame))
+    else:
+        frames = until_disconnected(request, stream_generation(mode, prompt, key, frame))
+
+    return StreamingResponse(
+        frames,
+        media_type=media_type,
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --------------------------------------------------------------------------- #
+#  Documents
+# --------------------------------------------------------------------------- #
+@app.post("/api/documents")
+async def create_document(request: Request, file: UploadFile, ocr_preset: str = Form(OCR_PRESET)):
+    """Extract an upload once and keep its text for later requests.
+
+    Identical uploads get the same id; re-uploading one is free unless it
+    asks for a different OCR preset.
+    """
+    if ocr_preset not in OCR_PRESETS:
+        return JSONResponse({"error": "Invalid OCR preset selected."}, status_code=400)
+
+    doc_id = await run_in_threadpool(upload_digest, file)
+    stored = await run_in_threadpool(documents.get, doc_id)
+    if stored is not None and stored["ocr_preset"] == ocr_preset:
+        metrics.incr("documents.deduplicated")
+        return {"id": doc_id, "chars": len(stored["text"]), "pages": len(stored["pages"])}
+
+    try:
+        text, pages = await unless_disconnected(request, load_text(file, MAPREDUCE_MAX_CHARS, ocr_preset))
+    except Unavailable as exc:
+        return unavailable_response(exc)
+    except ClientDisconnected:
+        return disconnected_response()
+    except Exception as exc:
+        logger.exception("Unexpected error")
+        return JSONResponse({"error": str(exc)}, status_code=500)
+    if not text:
+        return JSONResponse({"error": "No readable text found in the file."}, status_code=400)
+
+    record = {"text": text, "pages": pages, "filename": file.filename, "ocr_preset": ocr_preset}
+    await run_in_threadpool(documents.set, doc_id, record)
+    metrics.incr("documents.stored")
+    return {"id": doc_id, "chars": len(text), "pages": len(pages)}
+
+
+@app.post("/api/documents/{doc_id}/process")
+async def process_document(
+    request: Request,
+    doc_id: str,
+    mode: str,
+    strategy: str = "truncate",
+    speculate: bool = SPECULATIVE_GENERATION,
+):
+    modes = parse_modes(mode)
+    if invalid := invalid_request(modes, strategy, OCR_PRESET):
+        return invalid
+    stored = await run_in_threadpool(documents.get, doc_id)
+    if stored is None:
+        return JSONResponse({"error": "Unknown document; upload it again."}, status_code=404)
+
+    start_deadline()
+    try:
+        body, status = await unless_disconnected(request, run_pipeline(
+            Extracted(stored["text"], stored["pages"]), modes, strategy, speculative=speculate
+        ))
+    except Unavailable as exc:
+        return unavailable_response(exc)
+    except ClientDisconnected:
+        return disconnected_response()
+    return body if status == 200 else JSONResponse(body, status_code=status)
+
+
+# --------------------------------------------------------------------------- #
+#  Background jobs
+# --------------------------------------------------------------------------- #
+class JobQueue:
+    """Durable work queue in SQLite.
+
+    A worker claims a job by taking a lease on it and renews the lease while
+    it runs. Jobs whose lease runs out (the worker crashed or was killed) go
+    back to the queue, up to `max_attempts` runs in total.
+    """
+
+    def __init__(self, path: str, max_attempts: int, lease_s: float):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.lease_s = lease_s
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with self._conn() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, status TEXT NOT NULL,"
+                " mode TEXT NOT NULL, strategy TEXT NOT NULL, ocr_preset TEXT NOT NULL,"
+                " filename TEXT NOT NULL, data BLOB,"
+                " result BLOB, status_code INTEGER, error TEXT,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " run_after REAL NOT NULL, lease_until REAL,"
+                " created REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, run_after)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.row_factory = sqlite3.Row
+            self._local.conn = conn
+        return conn
+
+    def submit(self, filename: str, data: bytes, mode: str, strategy: str, ocr_preset: str) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._conn()
+        conn.execute(
+            "INSERT INTO jobs (id, status, mode, strategy, ocr_preset, filename, data,"
+            " run_after, created, updated) VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, mode, strategy, ocr_preset, filename, data, now, now, now),
+        )
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND updated < ?",
+            (now - JOB_RETENTION_S,),
+        )
+        return job_id
+
+    def claim(self) -> sqlite3.Row | None:
+        """Lease the oldest runnable job, or return None when there is none."""
+        conn = self._conn()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            while True:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE (status = 'queued' AND run_after <= ?)"
+                    " OR (status = 'running' AND lease_until < ?)"
+                    " ORDER BY created LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None or row["attempts"] < self.max_attempts:
+                    break
+                # Its last run died without reporting back: give up on it.
+                conn.execute(
+                    "UPDATE jobs SET status = 'failed', data = NULL, status_code = 500,"
+                    " error = 'Job worker stopped while running this job.', updated = ?"
+                    " WHERE id = ?",
+                    (now, row["id"]),
+                )
+                metrics.incr("jobs.failed")
+            if row is not None:
+                if row["status"] == "running":
+                    metrics.incr("jobs.lease_expired")
+                conn.execute(
+                    "UPDATE jobs SET status = 'running', attempts = attempts + 1,"
+                    " lease_until = ?, updated = ? WHERE id = ?",
+                    (now + self.lease_s, now, row["id"]),
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def renew(self, job_id: str) -> None:
+        self._conn().execute(
+            "UPDATE jobs SET lease_until = ? WHERE id = ? AND status = 'running'",
+            (time.time() + self.lease_s, job_id),
+        )
+
+    def finish(self, job_id: str, body: Dict[str, Any], status_code: int) -> None:
+        status = "done" if status_code == 200 else "failed"
+        self._conn().execute(
+            "UPDATE jobs SET status = ?, result = ?, status_code = ?, data = NULL,"
+            " lease_until = NULL, updated = ? WHERE id = ?",
+            (status, orjson.dumps(body), status_code, time.time(), job_id),
+        )
+        metrics.incr(f"jobs.{status}")
+
+    def retry_later(self, job_id: str, error: str, delay: float) -> None:
+        """Put a job back after a transient failure, unless it is out of attempts."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'queued', error = ?, run_after = ?, lease_until = NULL,"
+            " updated = ? WHERE id = ? AND attempts < ?",
+            (error, now + delay, now, job_id, self.max_attempts),
+        )
+        if cursor.rowcount:
+            metrics.incr("jobs.retried")
+        else:
+            self.finish(job_id, {"error": error}, 503)
+
+    def release(self, job_id: str) -> None:
+        """Put a running job back without counting the interrupted run."""
+        now = time.time()
+        cursor = self._conn().execute(
+            "UPDATE jobs SET status = 'queued', attempts = MAX(attempts - 1, 0), run_after = ?,"
+            " lease_until = NULL, updated = ? WHERE id = ? AND status = 'running'",
+            (now, now, job_id),
+        )
+        if cursor.rowcount:
+            metrics.incr("jobs.released")
+
+    def get(self, job_id: str) -> Dict[str, Any] | None:
+        row = self._conn().execute(
+            "SELECT id, status, mode, attempts, result, status_code, error, created, updated"
+            " FROM jobs WHERE id = ?",
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job = {key: row[key] for key in ("id", "status", "mode", "attempts", "created", "updated")}
+        if row["result"] is not None:
+            job["status_code"] = row["status_code"]
+            job["result"] = orjson.loads(row["result"])
+        elif row["error"]:
+            job["error"] = row["error"]
+        return job
+
+
+job_queue = JobQueue(JOBS_DB, JOB_MAX_ATTEMPTS, JOB_LEASE_S)
+_job_workers: list = []
+_job_supervisor: asyncio.Task | None = None
+
+
+async def run_job(job: sqlite3.Row) -> None:
+    start_deadline(JOB_DEADLINE_S)
+    upload = UploadFile(file=io.BytesIO(job["data"]), filename=job["filename"])
+
+    async def keep_lease() -> None:
+        while True:
+            await asyncio.sleep(JOB_LEASE_S / 3)
+            await run_in_threadpool(job_queue.renew, job["id"])
+
+    renewer = asyncio.create_task(keep_lease())
+    try:
+        modes = parse_modes(job["mode"])
+        body, status = await run_pipeline(upload, modes, job["strategy"], job["ocr_preset"])
+    except Unavailable as exc:
+        await run_in_threadpool(job_queue.retry_later, job["id"], str(exc), exc.retry_after)
+    else:
+        await run_in_threadpool(job_queue.finish, job["id"], body, status)
+    finally:
+        renewer.cancel()
+
+
+async def _work_jobs() -> None:
+    """Claim and run jobs until SIGTERM/SIGINT.
+
+    On a signal the worker stops claiming, and a job it is running goes back
+    to the queue without using up an attempt, so deploys don't fail long jobs.
+    """
+    stopping = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stopping.set)
+    await load_encoder()
+    stopped = asyncio.create_task(stopping.wait())
+    while not stopping.is_set():
+        job = await run_in_threadpool(job_queue.claim)
+        if job is None:
+            await asyncio.wait({stopped}, timeout=1)
+            continue
+        logger.info("job %s: %s, attempt %d", job["id"], job["mode"], job["attempts"] + 1)
+        running = asyncio.create_task(run_job(job))
+        await asyncio.wait({running, stopped}, return_when=asyncio.FIRST_COMPLETED)
+        if not running.done():
+            running.cancel()
+            await asyncio.wait({running})
+            await run_in_threadpool(job_queue.release, job["id"])
+            logger.info("job %s: requeued, worker is stopping", job["id"])
+    extraction_executor.shutdown()
+
+
+def job_worker() -> None:
+    """Entry point of a job worker process.
+
+    Each web worker starts JOB_WORKERS of these, so they get small pools
+    rather than a CPU count each.
+    """
+    global PROCESS_WORKERS, extraction_executor
+    PROCESS_WORKERS = JOB_WORKER_CONCURRENCY
+    extraction_executor = BoundedExecutor("extraction", JOB_WORKER_CONCURRENCY, EXTRACTION_QUEUE_SIZE)
+    workers.OCR_POOL_SIZE = JOB_WORKER_CONCURRENCY
+    asyncio.run(_work_jobs())
+
+
+def start_job_worker() -> multiprocessing.Process:
+    # Not a daemon: workers start their own process pool for large PDFs.
+    proc = multiprocessing.get_context("spawn").Process(target=job_worker, name="job-worker")
+    proc.start()
+    return proc
+
+
+async def supervise_job_workers() -> None:
+    """Replace job workers that died; their jobs are re-run once the lease expires."""
+    while True:
+        await asyncio.sleep(5)
+        for i, proc in enumerate(_job_workers):
+            if not proc.is_alive():
+                logger.warning("job worker %d exited with %s, restarting", proc.pid, proc.exitcode)
+                metrics.incr("jobs.worker_restarts")
+                _job_workers[i] = start_job_worker()
+
+
+@app.post("/api/jobs", status_code=202)
+async def submit_job(
+    file: UploadFile,
+    mode: str = Form(...),
+    strategy: str = Form("truncate"),
+    ocr_preset: str = Form(OCR_PRESET),
+):
+    if invalid := invalid_request(parse_modes(mode), strategy, ocr_preset):
+        return invalid
+    data = await file.read()
+    job_id = await run_in_threadpool(job_queue.submit, file.filename, data, mode, strategy, ocr_preset)
+    metrics.incr("jobs.submitted")
+    return {"id": job_id, "status": "queued"}
+
+
+@app.get("/api/jobs/{job_id}")
+async def job_status(job_id: str):
+    job = await run_in_threadpool(job_queue.get, job_id)
+    if job is None:
+        return JSONResponse({"error": "Unknown job."}, status_code=404)
+    return job
+
+
+# --------------------------------------------------------------------------- #
+#  Admin
+# --------------------------------------------------------------------------- #
+def check_admin(token: str | None) -> JSONResponse | None:
+    """Admin routes don't exist without ADMIN_TOKEN and need it when they do."""
+    if not ADMIN_TOKEN:
+        return JSONResponse({"error": "Not Found"}, status_code=404)
+    if token is None or not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        return JSONResponse({"error": "Forbidden."}, status_code=403)
+    return None
+
+
+@app.get("/api/admin/metrics")
+async def metrics_snapshot(x_admin_token: str | None = Header(None)):
+    if denied := check_admin(x_admin_token):
+        return denied
+    return metrics.snapshot()
+
+
+@app.get("/api/admin/cache/{name}")
+async def cache_stats(name: str, x_admin_token: str | None = Header(None)):
+    if denied := check_admin(x_admin_token):
+        return denied
+    if name not in CACHES:
+        return JSONResponse({"error": "Unknown cache."}, status_code=404)
+    return await run_in_threadpool(CACHES[name].stats)
+
+
+@app.delete("/api/admin/cache/{name}")
+async def cache_flush(name: str, x_admin_token: str | None = Header(None)):
+    if denied := check_admin(x_admin_token):
+        return denied
+    if name not in CACHES:
+        return JSONResponse({"error": "Unknown cache."}, status_code=404)
+    await run_in_threadpool(CACHES[name].clear)
+    return {"flushed": name}
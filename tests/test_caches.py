@@ -0,0 +1,19 @@
+import os
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from server import MemoryCache, SQLiteCache, TieredCache  # noqa: E402
+
+
+def test_memory_hits_keep_documents_hot_on_disk(tmp_path):
+    disk = SQLiteCache(str(tmp_path / "documents.sqlite3"), max_bytes=300)
+    documents = TieredCache(MemoryCache(1 << 20), disk, touch_disk=True)
+    documents.set("cold", os.urandom(100).hex())
+    documents.set("hot", os.urandom(100).hex())
+
+    for _ in range(100):
+        documents.get("hot")        # served from memory
+    documents.set("new", os.urandom(100).hex())
+
+    assert disk.get("hot") is not None
+    assert disk.get("cold") is None
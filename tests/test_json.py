@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+from server import JSONArrayStream, repair_json, safe_json_loads, strip_trailing_commas  # noqa: E402
+
+CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                      "benchmarks", "data", "malformed_outputs.json")
+with open(CORPUS, encoding="utf-8") as f:
+    CASES = json.load(f)
+
+
+@pytest.mark.parametrize("case", CASES, ids=[case["name"] for case in CASES])
+def test_malformed_outputs_corpus(case):
+    if not case["expect_items"]:
+        with pytest.raises(ValueError):
+            safe_json_loads(case["raw"], "flashcards")
+        return
+    result = safe_json_loads(case["raw"], "flashcards")
+
+    assert len(result) == case["expect_items"]
+    assert all(isinstance(item, dict) for item in result)
+
+
+def test_trailing_commas_dropped_outside_strings_only():
+    text = '[{"q": "a, ]", "options": ["x", "y",],},]'
+
+    assert strip_trailing_commas(text) == '[{"q": "a, ]", "options": ["x", "y"]}]'
+
+
+def test_trailing_comma_inside_escaped_string_is_kept():
+    text = r'[{"q": "say \",}\" twice"}]'
+
+    assert strip_trailing_commas(text) == text
+
+
+def test_repair_strips_fence_and_prose():
+    raw = 'Sure:\n```json\n[{"question": "Q", "answer": "A"},]\n```\nAnything else?'
+
+    assert repair_json(raw) == [{"question": "Q", "answer": "A"}]
+
+
+def test_repair_salvages_complete_objects_of_a_truncated_array():
+    raw = '[{"question": "Q1", "answer": "A1"}, {"question": "Q2", "answer": "A'
+
+    assert repair_json(raw) == [{"question": "Q1", "answer": "A1"}]
+
+
+def test_repair_rejects_text_without_objects():
+    with pytest.raises(ValueError):
+        repair_json("I couldn't find any flashcards in these notes.")
+
+
+def test_array_stream_emits_items_as_they_close():
+    parser = JSONArrayStream()
+    chunks = ['```json\n[{"q": "x ', '{not a brace}"', ', "n": [1, 2]}', ', {"q": "y"}', "]\n```"]
+
+    emitted = [parser.feed(chunk) for chunk in chunks]
+
+    assert emitted == [[], [], [{"q": "x {not a brace}", "n": [1, 2]}], [{"q": "y"}], []]
+
+
+def test_array_stream_ignores_objects_after_the_array():
+    assert JSONArrayStream().feed('[{"a": 1}] and {"b": 2}') == [{"a": 1}]
+
+
+def test_wrapped_list_is_unwrapped():
+    raw = '{"flashcards": [{"question": "Q1", "answer": "A1"}]}'
+
+    assert safe_json_loads(raw, "flashcards") == [{"question": "Q1", "answer": "A1"}]
+
+
+def test_object_without_a_single_list_is_rejected():
+    with pytest.raises(ValueError):
+        safe_json_loads('{"question": "Q1", "answer": "A1"}', "flashcards")
@@ -0,0 +1,73 @@
+import numpy as np
+
+from workers import band_cuts, stitch_bands
+
+
+def page(height: int, lines: list[tuple[int, int]], width: int = 200) -> np.ndarray:
+    """White page with a black bar for every (top, bottom) text line."""
+    pixels = np.full((height, width), 255, dtype=np.uint8)
+    for top, bottom in lines:
+        pixels[top:bottom, 10:190] = 0
+    return pixels
+
+
+def test_band_cuts_meet_between_lines():
+    lines = [(y, y + 20) for y in range(10, 400, 40)]
+    cuts = band_cuts(page(400, lines), 2, 30)
+
+    assert cuts[0][0] == 0 and cuts[-1][1] == 400
+    assert cuts[0][1] == cuts[1][0]
+    assert all(shared == 0 for *_, shared in cuts)
+    boundary = cuts[0][1]
+    assert not any(top < boundary < bottom for top, bottom in lines)
+
+
+def test_band_cuts_widen_around_a_line_they_cannot_avoid():
+    tall = (150, 230)                   # no blank row within 30 px of the middle
+    cuts = band_cuts(page(400, [(20, 40), tall, (300, 320)]), 2, 30)
+
+    (top_a, bottom_a, shared), (top_b, bottom_b, _) = cuts
+    assert shared == 1
+    assert bottom_a == tall[1] and top_b == tall[0]     # both bands see the whole line
+    assert top_a == 0 and bottom_b == 400
+
+
+def test_band_cuts_blank_page():
+    cuts = band_cuts(np.full((300, 50), 255, dtype=np.uint8), 3, 20)
+
+    assert [shared for *_, shared in cuts] == [0, 0, 0]
+    assert [top for top, *_ in cuts][0] == 0 and cuts[-1][1] == 300
+
+
+def test_stitch_keeps_similar_but_different_lines():
+    texts = ["Kinematics\nv = u + a t\ns = u t", "s = v t\nv^2 = u^2 + 2 a s"]
+
+    assert stitch_bands(texts, [1]).splitlines() == [
+        "Kinematics", "v = u + a t", "s = u t", "s = v t", "v^2 = u^2 + 2 a s",
+    ]
+
+
+def test_stitch_only_drops_the_shared_lines():
+    texts = ["line a\nline b\nline c", "line c\nline d", "line d\nline e"]
+
+    assert stitch_bands(texts, [1, 0]).splitlines() == [
+        "line a", "line b", "line c", "line d", "line d", "line e",
+    ]
+    assert stitch_bands(texts, [1, 1]).splitlines() == [
+        "line a", "line b", "line c", "line d", "line e",
+    ]
+
+
+def test_stitch_tolerates_whitespace_and_small_ocr_noise_on_long_lines():
+    above = "Intro\nNewton's second law:  F = m a for constant mass"
+    below = "Newton's second law: F = m a for constant mass.\nNext"
+
+    assert stitch_bands([above, below], [1]).splitlines() == [
+        "Intro", "Newton's second law:  F = m a for constant mass", "Next",
+    ]
+
+
+def test_stitch_without_overlap_info_drops_nothing():
+    texts = ["Step 1\nStep 2", "Step 2\nStep 3"]
+
+    assert stitch_bands(texts).splitlines() == ["Step 1", "Step 2", "Step 2", "Step 3"]
@@ -0,0 +1,229 @@
+"""Extraction and OCR code that runs in the spawned process pool.
+
+Pool workers import this module rather than server.py, so they start
+without the web app, the OpenAI client or the SQLite stores. Only
+PyMuPDF, Pillow, NumPy and Tesseract are loaded here.
+"""
+import difflib
+import logging
+import os
+import queue
+import time
+from functools import lru_cache
+from multiprocessing import shared_memory
+from typing import Dict, Any, NamedTuple
+
+import fitz                    # PyMuPDF
+import numpy as np
+import pytesseract
+from PIL import Image
+from dotenv import load_dotenv
+try:                                   # optional: warm C-API OCR engines
+    import tesserocr
+except ImportError:
+    tesserocr = None
+
+load_dotenv()
+logger = logging.getLogger("notegenie-backend")
+
+# PDF pages without a text layer (scans) are rendered at PDF_OCR_DPI and OCR'd.
+PDF_OCR_DPI = int(os.getenv("PDF_OCR_DPI", "200"))
+
+# OCR_ENGINE is "tesserocr" (a pool of OCR_POOL_SIZE warm Tesseract
+# instances, requires the tesserocr package), "pytesseract" (one tesseract
+# process per image) or "auto" (tesserocr when installed).
+OCR_ENGINE = os.getenv("OCR_ENGINE", "auto")
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+OCR_POOL_SIZE = int(os.getenv("OCR_POOL_SIZE", str(os.cpu_count() or 1)))
+
+
+def ready() -> int:
+    """No-op task that makes a fresh pool worker import this module."""
+    return os.getpid()
+
+
+def read_shared(shm_name: str, size: int) -> bytes:
+    """Copy `size` bytes out of a segment created by the parent.
+
+    Spawned workers share the parent's resource tracker, and the parent
+    unlinks the segment, so the attach is left registered as it is.
+    """
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        view = shm.buf[:size]
+        data = bytes(view)
+        view.release()
+    finally:
+        shm.close()
+    return data
+
+
+class Piece(NamedTuple):
+    text: str
+    page: Dict[str, Any] | None         # {"page", "source": "text"|"ocr", "ms"}
+
+
+def page_info(index: int, source: str, started: float) -> Dict[str, Any]:
+    return {"page": index + 1, "source": source, "ms": round((time.perf_counter() - started) * 1000, 1)}
+
+
+def needs_ocr(page: fitz.Page, text: str) -> bool:
+    """A page with images but no text layer is a scan."""
+    return not text.strip() and bool(page.get_images())
+
+
+def render_page(page: fitz.Page) -> Image.Image:
+    pix = page.get_pixmap(dpi=PDF_OCR_DPI, colorspace=fitz.csGRAY, alpha=False)
+    return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+
+
+def ocr_page(page: fitz.Page, engine: Any) -> str:
+    return engine.image_to_string(render_page(page))
+
+
+def extract_page_range(shm_name: str, size: int, start: int, stop: int) -> list[Piece]:
+    """Pool worker: pages [start, stop) of the PDF in shared memory, OCR'ing scans."""
+    pieces = []
+    with fitz.open(stream=read_shared(shm_name, size), filetype="pdf") as doc:
+        for index in range(start, stop):
+            started = time.perf_counter()
+            page = doc[index]
+            text, source = page.get_text(), "text"
+            if needs_ocr(page, text):
+                text, source = ocr_page(page, get_ocr_engine(1)), "ocr"
+            pieces.append(Piece(text, page_info(index, source, started)))
+    return pieces
+
+
+def ocr_pdf_pages(shm_name: str, size: int, indices: list[int]) -> list[Piece]:
+    """Pool worker: render and OCR scanned pages of the PDF in shared memory."""
+    pieces = []
+    with fitz.open(stream=read_shared(shm_name, size), filetype="pdf") as doc:
+        for index in indices:
+            started = time.perf_counter()
+            pieces.append(Piece(ocr_page(doc[index], get_ocr_engine(1)), page_info(index, "ocr", started)))
+    return pieces
+
+
+class PytesseractEngine:
+    """Shells out to the tesseract binary, reloading the model for every image."""
+
+    name = "pytesseract"
+
+    def image_to_string(self, image: Image.Image) -> str:
+        return pytesseract.image_to_string(image, lang=OCR_LANG)
+
+
+class TesserocrPool:
+    """Long-lived Tesseract C-API instances, checked out one per image.
+
+    Each instance loads the language model once; instances are not
+    thread-safe, so a thread holds one for the duration of a call.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self, size: int):
+        self._idle: queue.Queue = queue.Queue()
+        for _ in range(size):
+            self._idle.put(tesserocr.PyTessBaseAPI(lang=OCR_LANG))
+
+    def image_to_string(self, image: Image.Image) -> str:
+        api = self._idle.get()
+        try:
+            api.SetImage(image)
+            return api.GetUTF8Text()
+        finally:
+            api.Clear()
+            self._idle.put(api)
+
+
+@lru_cache(maxsize=None)
+def get_ocr_engine(pool_size: int | None = None) -> PytesseractEngine | TesserocrPool:
+    """The process-wide OCR engine, created on first use.
+
+    Process-pool workers OCR one image at a time and ask for a pool of one;
+    everyone else gets OCR_POOL_SIZE instances.
+    In "auto" mode a tesserocr that can't load its language data (see
+    TESSDATA_PREFIX) falls back to pytesseract instead of failing every OCR.
+    """
+    if OCR_ENGINE == "tesserocr" or (OCR_ENGINE == "auto" and tesserocr is not None):
+        if tesserocr is None:
+            raise RuntimeError("OCR_ENGINE=tesserocr but the tesserocr package is not installed")
+        try:
+            return TesserocrPool(pool_size or OCR_POOL_SIZE)
+        except RuntimeError:
+            if OCR_ENGINE == "tesserocr":
+                raise
+            logger.warning("tesserocr could not load %r, falling back to pytesseract", OCR_LANG, exc_info=True)
+    return PytesseractEngine()
+
+
+def ocr_band(shm_name: str, width: int, height: int, top: int, bottom: int) -> str:
+    """Pool worker: OCR rows [top, bottom) of the grayscale image in shared memory."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        pixels = np.ndarray((height, width), dtype=np.uint8, buffer=shm.buf)
+        band = pixels[top:bottom].copy()
+        del pixels                      # release the export before closing
+    finally:
+        shm.close()
+    return get_ocr_engine(1).image_to_string(Image.fromarray(band))
+
+
+def band_cuts(pixels: np.ndarray, bands: int, overlap: int) -> list[tuple[int, int, int]]:
+    """(top, bottom, shared) row ranges for `bands` bands, cut where rows hold least ink.
+
+    Each nominal cut moves to the lightest row within `overlap` of it. If
+    that row is blank the bands simply meet there. Otherwise a text line
+    runs through it, and both bands are widened to the blank rows around
+    that line (at most `overlap` past the search window), so each sees it
+    whole. `shared` is the number of such lines a band has in common with
+    the next one.
+    """
+    height = pixels.shape[0]
+    ink = (255 - pixels).sum(axis=1, dtype=np.int64)
+    blank = ink <= ink.min() + (ink.max() - ink.min()) // 50
+    tops, bottoms, shared = [0], [], []
+    for i in range(1, bands):
+        nominal = height * i // bands
+        lo, hi = max(1, nominal - overlap), min(height - 1, nominal + overlap)
+        cut = lo + int(np.argmin(ink[lo:hi]))
+        top, bottom = cut, cut
+        if not blank[cut]:
+            while top > max(0, lo - overlap) and not blank[top - 1]:
+                top -= 1
+            bottom = cut + 1
+            while bottom < min(height, hi + overlap) and not blank[bottom]:
+                bottom += 1
+        tops.append(top)
+        bottoms.append(bottom)
+        shared.append(0 if top == bottom else 1)
+    bottoms.append(height)
+    shared.append(0)
+    return list(zip(tops, bottoms, shared))
+
+
+def _same_line(a: str, b: str) -> bool:
+    """Two OCR readings of one line: equal up to whitespace, or nearly so if long."""
+    a, b = " ".join(a.split()), " ".join(b.split())
+    if a == b:
+        return True
+    return min(len(a), len(b)) >= 12 and difflib.SequenceMatcher(None, a, b).ratio() >= 0.95
+
+
+def stitch_bands(texts: list[str], shared: list[int] | None = None) -> str:
+    """Join band texts, dropping the lines two neighbouring bands both read.
+
+    `shared[i]` is how many lines band i has in common with band i + 1 (see
+    `band_cuts`); those are dropped from the second band only if they match
+    the end of the first. Nothing else is ever removed.
+    """
+    lines: list[str] = []
+    for i, text in enumerate(texts):
+        new = [line for line in text.splitlines() if line.strip()]
+        k = min(shared[i - 1], len(lines), len(new)) if shared and i else 0
+        if k and all(_same_line(x, y) for x, y in zip(lines[-k:], new[:k])):
+            new = new[k:]
+        lines.extend(new)
+    return "\n".join(lines)